@@ -0,0 +1,202 @@
+"""Compare the native and the avogadro molecular orbital engines
+
+Builds synthetic carbon clusters with a 6-31G*-like basis set and random MO
+coefficients, then times openchemistry._utils.calculate_mo with each engine.
+The clusters only have S, P and cartesian D shells.
+
+Then every basis function of every supported shell type (S, P, cartesian and
+spherical D and F) is evaluated on its own, as an orbital of a single atom.
+Its norm is reported for both engines, it is 1 for a normalized basis
+function, with the correlation and the scale factor between the two
+engines. Basis functions on which the engines disagree are marked with a *.
+
+    python benchmarks/bench_calculate_mo.py --atoms 10 50 100
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+# The directory containing the openchemistry package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openchemistry._orbitals import ANGSTROM_TO_BOHR
+from openchemistry._utils import calculate_mo, calculate_mos
+
+# (shell type, [(exponent, coefficient), ...]) for a carbon atom
+CARBON_BASIS = [
+    (0, [(3047.52, 0.0018347), (457.370, 0.0140373), (103.949, 0.0688426),
+         (29.2102, 0.232184), (9.28666, 0.467941), (3.16393, 0.362312)]),
+    (0, [(7.86827, -0.119332), (1.88129, -0.160854), (0.544249, 1.14346)]),
+    (1, [(7.86827, 0.0689991), (1.88129, 0.316424), (0.544249, 0.744308)]),
+    (0, [(0.168714, 1.0)]),
+    (1, [(0.168714, 1.0)]),
+    (2, [(0.8, 1.0)])
+]
+
+# The basis functions of each shell type, in the order of the MO coefficients
+COMPONENTS = {
+    0: ['s'],
+    1: ['x', 'y', 'z'],
+    2: ['xx', 'yy', 'zz', 'xy', 'xz', 'yz'],
+    -2: ['d0', 'd+1', 'd-1', 'd+2', 'd-2'],
+    3: ['xxx', 'yyy', 'zzz', 'xyy', 'xxy', 'xxz', 'xzz', 'yzz', 'yyz', 'xyz'],
+    -3: ['f0', 'f+1', 'f-1', 'f+2', 'f-2', 'f+3', 'f-3']
+}
+
+def synthetic_cjson(atom_count, seed=0):
+    rng = np.random.default_rng(seed)
+    side = math.ceil(atom_count ** (1 / 3))
+    coords = []
+    for i in range(atom_count):
+        x, y, z = i // (side * side), (i // side) % side, i % side
+        coords.extend([1.5 * x, 1.5 * y, 1.5 * z])
+
+    shell_types = []
+    primitives_per_shell = []
+    shell_to_atom = []
+    exponents = []
+    coefficients = []
+    n_basis = 0
+    sizes = {0: 1, 1: 3, 2: 6}
+    for atom in range(atom_count):
+        for shell_type, primitives in CARBON_BASIS:
+            shell_types.append(shell_type)
+            primitives_per_shell.append(len(primitives))
+            shell_to_atom.append(atom)
+            for exponent, coefficient in primitives:
+                exponents.append(exponent)
+                coefficients.append(coefficient)
+            n_basis += sizes[shell_type]
+
+    # Only a few orbitals are needed, the rest are never evaluated
+    n_mo = 4
+    mo_coefficients = rng.normal(scale=n_basis ** -0.5, size=(n_mo, n_basis))
+
+    return {
+        'chemicalJson': 1,
+        'atoms': {
+            'elements': {'number': [6] * atom_count},
+            'coords': {'3d': coords}
+        },
+        'basisSet': {
+            'coefficients': coefficients,
+            'exponents': exponents,
+            'primitivesPerShell': primitives_per_shell,
+            'shellToAtomMap': shell_to_atom,
+            'shellTypes': shell_types,
+            'scfType': 'rhf'
+        },
+        'orbitals': {
+            'moCoefficients': mo_coefficients.ravel().tolist(),
+            'electronCount': 2 * n_mo
+        }
+    }, n_basis
+
+def shell_cjson(shell_type, exponent=0.8):
+    """A single atom with one shell, each MO is one of its basis functions."""
+    n_basis = len(COMPONENTS[shell_type])
+
+    return {
+        'chemicalJson': 1,
+        'atoms': {
+            'elements': {'number': [6]},
+            'coords': {'3d': [0.0, 0.0, 0.0]}
+        },
+        'basisSet': {
+            'coefficients': [1.0],
+            'exponents': [exponent],
+            'primitivesPerShell': [1],
+            'shellToAtomMap': [0],
+            'shellTypes': [shell_type],
+            'scfType': 'rhf'
+        },
+        'orbitals': {
+            'moCoefficients': np.eye(n_basis).ravel().tolist(),
+            'electronCount': 2
+        }
+    }
+
+def _norm(cube):
+    """The integral of the square of a cube, in Bohr^3."""
+    scalars = np.asarray(cube['scalars'])
+    volume = np.prod(cube['spacing']) * ANGSTROM_TO_BOHR ** 3
+
+    return (scalars * scalars).sum() * volume
+
+def compare_shell(shell_type, skip_avogadro):
+    """
+    Yields the name, the norm with each engine, the correlation and the
+    avogadro / numpy scale factor of every basis function of a shell type.
+    """
+    cjson = shell_cjson(shell_type)
+    cubes = calculate_mos(cjson, range(len(COMPONENTS[shell_type])),
+                          engine='numpy')
+
+    for i, cube in enumerate(cubes):
+        values = np.asarray(cube['scalars'])
+        reference_norm = correlation = scale = math.nan
+        if not skip_avogadro:
+            reference = calculate_mo(cjson, i, engine='avogadro')
+            reference_norm = _norm(reference)
+            reference = np.asarray(reference['scalars'])
+            if reference.shape == values.shape:
+                correlation = np.corrcoef(values, reference)[0, 1]
+                scale = reference @ values / (values @ values)
+
+        yield (COMPONENTS[shell_type][i], _norm(cube), reference_norm,
+               correlation, scale)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the molecular orbital engines.')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[10, 50, 100],
+                        help='the number of atoms of the synthetic molecules')
+    parser.add_argument('--mo', type=int, default=1,
+                        help='the index of the orbital to compute')
+    parser.add_argument('--skip-avogadro', action='store_true',
+                        help='only time the native engine')
+
+    args = parser.parse_args()
+
+    print('%8s %8s %12s %12s %12s %10s' % (
+        'atoms', 'basis', 'points', 'numpy (s)', 'avogadro (s)', 'max diff'))
+    for atom_count in args.atoms:
+        cjson, n_basis = synthetic_cjson(atom_count)
+        cube, numpy_time = timed(calculate_mo, cjson, args.mo, engine='numpy')
+        points = len(cube['scalars'])
+
+        avogadro_time = math.nan
+        diff = math.nan
+        if not args.skip_avogadro:
+            reference, avogadro_time = timed(calculate_mo, cjson, args.mo,
+                                             engine='avogadro')
+            if reference['dimensions'] == cube['dimensions']:
+                diff = np.abs(np.asarray(reference['scalars']) -
+                              np.asarray(cube['scalars'])).max()
+
+        print('%8d %8d %12d %12.3f %12.3f %10.2e' % (
+            atom_count, n_basis, points, numpy_time, avogadro_time, diff))
+
+    print()
+    print('%6s %10s %12s %12s %12s %12s' % (
+        'shell', 'function', 'numpy norm', 'avogadro', 'correlation',
+        'scale'))
+    for shell_type in sorted(COMPONENTS, key=lambda t: (abs(t), -t)):
+        for name, norm, reference_norm, correlation, scale in compare_shell(
+                shell_type, args.skip_avogadro):
+            mismatch = abs(correlation - 1) > 1e-6 or abs(scale - 1) > 1e-4
+            print('%6d %10s %12.6f %12.6f %12.6f %12.6f %s' % (
+                shell_type, name, norm, reference_norm, correlation, scale,
+                '*' if mismatch else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""End-to-end benchmark of the client against a local Girder stand-in
+
+Runs the main workflows of the client against the in-process server of
+fake_girder.py, for batches of N molecules, and reports their wall time,
+throughput and the number of requests sent (from oc.stats):
+
+- find_molecule: sequential lookups, the same through openchemistry.aio, and
+  through openchemistry.aio with every identifier repeated 10 times to show
+  the coalescing of identical requests
+- run_calculations: submitting new calculations, then running the same batch
+  again when all the calculations already exist
+- sync_calculation_index: syncing a new local calculation index, then
+  running the batch again with the index enabled
+- find_structure: looking up the calculations, sequentially and through
+  openchemistry.aio
+- monitor: waiting for the submitted calculations with oc.wait
+- visualization: loading the orbitals and vibrations of the results, then
+  the same through a new disk cache, again after reopening the warm disk
+  cache, and with every cached document revalidated by the server
+
+The sequential variants are skipped above --sequential-limit molecules.
+
+    python benchmarks/bench_client.py --sizes 10 1000 10000 --latency 1
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_girder import FakeGirder
+
+# The directory containing the openchemistry package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+IMAGE = 'openchemistry/benchmark:latest'
+PARAMETERS = {'task': 'energy', 'theory': 'dft', 'basis': '6-31g'}
+
+class Case(object):
+    def __init__(self, name, count, elapsed, summary, coalesced):
+        self.name = name
+        self.count = count
+        self.elapsed = elapsed
+        self.summary = summary
+        self.coalesced = coalesced
+
+def _configure(girder):
+    # Never talk to a real server
+    for name in ['OC_TOKEN', 'OC_API_KEY', 'OC_INTERNAL_API_URL',
+                 'OC_DISK_CACHE_DIR', 'OC_JUPYTERHUB_URL', 'OC_CLUSTER_ID']:
+        os.environ.pop(name, None)
+    os.environ['OC_API_URL'] = girder.url
+    os.environ['GIRDER_TOKEN'] = 'benchmark'
+
+def _reset_caches():
+    from openchemistry._cache import CubeCache
+    from openchemistry._status import TaskflowStatusCache
+
+    CubeCache().clear()
+    TaskflowStatusCache().clear()
+
+def measure(name, count, func, *args):
+    """Run func(*args) and collect the requests it sent."""
+    import openchemistry as oc
+
+    _reset_caches()
+    oc.stats(reset=True)
+    coalesced = oc.coalesced_requests()
+
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+
+    case = Case(name, count, elapsed, oc.stats(reset=True),
+                oc.coalesced_requests() - coalesced)
+
+    return case, result
+
+def _aio_map(func, items):
+    from openchemistry import aio
+
+    async def run():
+        return await aio.gather(*[func(x) for x in items])
+
+    return asyncio.run(run())
+
+def find_molecules(inchikeys):
+    import openchemistry as oc
+    return [oc.find_molecule(x) for x in inchikeys]
+
+def find_molecules_aio(inchikeys):
+    from openchemistry import aio
+    return _aio_map(aio.find_molecule, inchikeys)
+
+def run_calculations(molecules):
+    import openchemistry as oc
+    return oc.run_calculations(molecules, IMAGE, PARAMETERS)
+
+def find_structures(inchikeys):
+    import openchemistry as oc
+    return [oc.find_structure(x, IMAGE, PARAMETERS) for x in inchikeys]
+
+def find_structures_aio(inchikeys):
+    from openchemistry import aio
+
+    def find(inchikey):
+        return aio.find_structure(inchikey, IMAGE, PARAMETERS)
+
+    return _aio_map(find, inchikeys)
+
+def monitor(results):
+    import openchemistry as oc
+    return oc.wait(results, interval=0.05, max_interval=0.5)
+
+def _fresh(results, complete=True):
+    # The providers keep the documents they loaded, start from new objects.
+    # The documents of incomplete calculations are revalidated by the disk
+    # cache.
+    from openchemistry._calculation import CalculationResult
+
+    return [CalculationResult(x._id, x._properties if complete else
+                              dict(x._properties, pending=True),
+                              x._molecule_id)
+            for x in results]
+
+def _reopen_disk_cache(path):
+    # Like a new session, only the documents on disk are left
+    import openchemistry as oc
+
+    oc.disable_disk_cache()
+    oc.enable_disk_cache(path)
+
+def _load_visualizations(result):
+    result.orbitals.load(['homo'])
+    result.vibrations.data()
+
+def load_visualizations(results):
+    for result in results:
+        _load_visualizations(result)
+
+def load_visualizations_threads(results, workers):
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(_load_visualizations, results))
+
+def run(girder, count, sequential_limit, workers):
+    """Run all the cases for a batch of count molecules."""
+    inchikeys = girder.add_molecules(count)
+    sequential = count <= sequential_limit
+    cases = []
+
+    if sequential:
+        case, molecules = measure('find_molecule', count, find_molecules,
+                                  inchikeys)
+        cases.append(case)
+    case, molecules = measure('find_molecule (aio)', count,
+                              find_molecules_aio, inchikeys)
+    cases.append(case)
+
+    # Each identifier is looked up 10 times in a row
+    duplicates = [x for x in inchikeys[:max(1, count // 10)]
+                  for _ in range(10)]
+    case, _ = measure('find_molecule (aio, duplicates)', len(duplicates),
+                      find_molecules_aio, duplicates)
+    cases.append(case)
+
+    case, results = measure('run_calculations (submit)', count,
+                            run_calculations, molecules)
+    cases.append(case)
+    case, _ = measure('run_calculations (existing)', count,
+                      run_calculations, molecules)
+    cases.append(case)
+
+    case, results = measure('monitor', count, monitor, results)
+    cases.append(case)
+
+    import openchemistry as oc
+    with tempfile.TemporaryDirectory() as path:
+        oc.enable_calculation_index(path)
+        case, synced = measure('sync_calculation_index', count,
+                               oc.sync_calculation_index)
+        # All the calculations of the server, not only this batch
+        case.count = synced
+        cases.append(case)
+        case, _ = measure('run_calculations (index)', count,
+                          run_calculations, molecules)
+        cases.append(case)
+        oc.disable_calculation_index()
+
+    if sequential:
+        case, _ = measure('find_structure', count, find_structures,
+                          inchikeys)
+        cases.append(case)
+    case, _ = measure('find_structure (aio)', count, find_structures_aio,
+                      inchikeys)
+    cases.append(case)
+
+    if sequential:
+        case, _ = measure('visualization', count, load_visualizations,
+                          _fresh(results))
+        cases.append(case)
+    case, _ = measure('visualization (%d threads)' % workers, count,
+                      load_visualizations_threads, _fresh(results), workers)
+    cases.append(case)
+
+    with tempfile.TemporaryDirectory() as path:
+        oc.enable_disk_cache(path)
+        case, _ = measure('visualization (cold disk cache)', count,
+                          load_visualizations_threads, _fresh(results),
+                          workers)
+        cases.append(case)
+        _reopen_disk_cache(path)
+        case, _ = measure('visualization (warm disk cache)', count,
+                          load_visualizations_threads, _fresh(results),
+                          workers)
+        cases.append(case)
+        # Documents that are not known to be final are revalidated
+        oc.clear_disk_cache()
+        _reset_caches()
+        load_visualizations_threads(_fresh(results, complete=False), workers)
+        _reopen_disk_cache(path)
+        case, _ = measure('visualization (revalidated)', count,
+                          load_visualizations_threads,
+                          _fresh(results, complete=False), workers)
+        cases.append(case)
+        oc.disable_disk_cache()
+
+    return cases
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the client against a local Girder stand-in.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 1000, 10000],
+                        help='the number of molecules of the batches')
+    parser.add_argument('--latency', type=float, default=1,
+                        help='the latency of every request, in milliseconds')
+    parser.add_argument('--run-time', type=float, default=0.2,
+                        help='the seconds a taskflow runs for')
+    parser.add_argument('--cube-points', type=int, default=1000,
+                        help='the number of points of the orbital cubes')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='the number of concurrent requests of the '
+                             'aio and threaded cases')
+    parser.add_argument('--sequential-limit', type=int, default=1000,
+                        help='skip the sequential cases for larger batches')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print the requests of every case by endpoint')
+
+    args = parser.parse_args()
+
+    with FakeGirder(args.latency / 1000, args.run_time,
+                    args.cube_points) as girder:
+        _configure(girder)
+        girder.add_image(*IMAGE.split(':'))
+
+        from openchemistry import aio
+        from openchemistry._metrics import format_stats
+        aio.set_concurrency(args.concurrency)
+
+        print('%-34s %7s %10s %10s %10s %10s' % (
+            'case', 'N', 'time (s)', 'ops/s', 'requests', 'coalesced'))
+        for count in args.sizes:
+            for case in run(girder, count, args.sequential_limit,
+                            args.concurrency):
+                print('%-34s %7d %10.3f %10.1f %10d %10d' % (
+                    case.name, case.count, case.elapsed,
+                    case.count / case.elapsed, case.summary['requests'],
+                    case.coalesced))
+                if args.verbose:
+                    summary = dict(case.summary, coalesced=case.coalesced)
+                    print(format_stats(summary, case.elapsed) + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Import time regression benchmark
+
+Runs `python -X importtime` on a few import statements in fresh
+interpreters and reports the cumulative import time of each one. Exits with
+a non zero status if an import exceeds its budget, or if importing the
+package loads one of the heavy dependencies.
+
+    python benchmarks/bench_import.py --budget-ms 50
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Run the interpreters with the openchemistry package of this checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV = dict(os.environ, PYTHONPATH=os.pathsep.join(
+    [ROOT] + [x for x in [os.environ.get('PYTHONPATH')] if x]))
+
+STATEMENTS = [
+    ('import openchemistry', 'openchemistry'),
+    ('import openchemistry.io', 'openchemistry.io'),
+    ('from openchemistry import _girder', 'openchemistry._girder')
+]
+
+# None of these should be loaded by a bare `import openchemistry`
+HEAVY_MODULES = [
+    'avogadro', 'numpy', 'rmsd', 'jsonpath_rw', 'jinja2', 'IPython',
+    'requests', 'girder_client'
+]
+
+def import_time(statement, module, repeat):
+    """The best cumulative import time of module, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                            statement],
+                           stderr=subprocess.PIPE, universal_newlines=True,
+                           env=ENV, check=True)
+        for line in p.stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = [f.strip() for f in line.split('|')]
+            if len(fields) == 3 and fields[2] == module:
+                cumulative = int(fields[1]) / 1000
+                if best is None or cumulative < best:
+                    best = cumulative
+
+    return best
+
+def loaded_heavy_modules():
+    code = ('import sys, openchemistry; '
+            'print(" ".join(m for m in %r if m in sys.modules))' %
+            HEAVY_MODULES)
+    p = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                       universal_newlines=True, env=ENV, check=True)
+
+    return p.stdout.split()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the import time of openchemistry.')
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.environ.get('OC_IMPORT_BUDGET_MS',
+                                                     50)),
+                        help='the maximum cumulative import time of '
+                             '`import openchemistry`')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the number of runs, the best one is reported')
+
+    args = parser.parse_args()
+    failed = False
+
+    for statement, module in STATEMENTS:
+        elapsed = import_time(statement, module, args.repeat)
+        print('%-40s %8.1f ms' % (statement, elapsed))
+        if module == 'openchemistry' and elapsed > args.budget_ms:
+            print('  over the budget of %.1f ms' % args.budget_ms)
+            failed = True
+
+    heavy = loaded_heavy_modules()
+    if heavy:
+        print('`import openchemistry` loads: %s' % ', '.join(heavy))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+"""An in-process stand-in for the Girder server used by the benchmarks
+
+Serves the REST endpoints used by the openchemistry client from memory:
+molecules, calculations, images, the taskflow launch and status, queues, and
+the cjson, cube and vibrationalmodes documents of the calculations. Every
+request is delayed by a configurable latency, to mimic the round trip to a
+real server.
+
+    with FakeGirder(latency=0.001) as girder:
+        girder.add_molecules(100)
+        os.environ['OC_API_URL'] = girder.url
+
+Launched taskflows are 'running' for run_time seconds, after which they are
+'complete' and their calculations are no longer pending.
+
+GET responses carry an ETag, and the documents of the calculations also a
+Last-Modified header, so that conditional requests are answered with
+304 Not Modified.
+"""
+import collections
+import datetime
+import email.utils
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+API_ROOT = '/api/v1/'
+
+def _object_id(counter):
+    return '%024x' % counter
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _http_date(timestamp):
+    return email.utils.format_datetime(
+        datetime.datetime.fromisoformat(timestamp), usegmt=True)
+
+def _etag(content):
+    return '"%s"' % hashlib.sha1(content).hexdigest()
+
+def _not_modified(headers, etag, last_modified):
+    """Whether the conditional headers of a request match the document."""
+    if 'If-None-Match' in headers:
+        return etag in headers['If-None-Match']
+
+    since = headers.get('If-Modified-Since')
+    if since is None or last_modified is None:
+        return False
+    try:
+        since = email.utils.parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+
+    return email.utils.parsedate_to_datetime(last_modified) <= since
+
+def _inchikey(i):
+    # Looks like an InChIKey to the client: 27 characters, '-' at 14 and 25
+    return '%014d-BENCHMARKS-N' % i
+
+def _cjson():
+    # Water
+    return {
+        'chemicalJson': 1,
+        'atoms': {
+            'elements': {'number': [8, 1, 1]},
+            'coords': {'3d': [0.0, 0.0, 0.0, 0.96, 0.0, 0.0, -0.24, 0.93, 0.0]}
+        }
+    }
+
+def _cube(points):
+    side = max(1, round(points ** (1 / 3)))
+    return {
+        'cube': {
+            'origin': [-2.0, -2.0, -2.0],
+            'spacing': [4.0 / side] * 3,
+            'dimensions': [side] * 3,
+            'scalars': [((i % 17) - 8) / 100.0 for i in range(side ** 3)]
+        }
+    }
+
+def _vibrations(modes):
+    return {
+        'modes': list(range(modes)),
+        'frequencies': [100.0 * (i + 1) for i in range(modes)],
+        'intensities': [1.0 / (i + 1) for i in range(modes)],
+        'eigenVectors': [[0.0] * 9 for _ in range(modes)]
+    }
+
+class RestError(Exception):
+    def __init__(self, status, message=''):
+        super(RestError, self).__init__(message)
+        self.status = status
+
+class FakeGirder(object):
+    """
+    The state of the fake server, and the thread serving it
+
+    Parameters
+    ----------
+    latency : float
+        Seconds every request is delayed by.
+    run_time : float
+        Seconds a launched taskflow runs for.
+    cube_points : int
+        The number of points of the cubes served for the orbitals.
+    """
+
+    def __init__(self, latency=0, run_time=0.2, cube_points=1000):
+        self.latency = latency
+        self.run_time = run_time
+        self._lock = threading.Lock()
+        self._ids = 0
+        self.molecules = {}
+        self.inchikeys = {}
+        self.calculations = {}
+        self.calculation_keys = {}
+        self.taskflows = {}
+        self.images = {}
+        self.requests = collections.Counter()
+        # The conditional requests answered with 304 Not Modified
+        self.not_modified = 0
+
+        # The documents are the same for every calculation, encode them once
+        self._cjson_body = _encode(_cjson())
+        self._cube_body = _encode(_cube(cube_points))
+        self._vibrations_body = _encode(_vibrations(3))
+
+        self._routes = [
+            ('GET', '^molecules$', self._find_molecules),
+            ('GET', '^molecules/search$', self._search_molecules),
+            ('GET', '^molecules/inchikey/([^/]+)$', self._molecule_by_inchikey),
+            ('GET', '^molecules/([0-9a-f]{24})$', self._molecule),
+            ('GET', '^molecules/([0-9a-f]{24})/cjson$', self._molecule_cjson),
+            ('GET', '^calculations$', self._find_calculations),
+            ('POST', '^calculations$', self._create_calculation),
+            ('GET', '^calculations/([0-9a-f]{24})$', self._calculation),
+            ('PUT', '^calculations/([0-9a-f]{24})/properties$',
+             self._set_properties),
+            ('PATCH', '^calculations/([0-9a-f]{24})/notebooks$',
+             self._set_notebooks),
+            ('GET', '^calculations/([0-9a-f]{24})/cjson$',
+             self._calculation_cjson),
+            ('GET', '^calculations/([0-9a-f]{24})/vibrationalmodes$',
+             self._calculation_vibrations),
+            ('GET', '^calculations/([0-9a-f]{24})/cube/([^/]+)$',
+             self._calculation_cube),
+            ('GET', '^images$', self._find_images),
+            ('POST', '^launch_taskflow/launch$', self._launch_taskflow),
+            ('GET', '^taskflows/([0-9a-f]{24})/status$', self._taskflow_status),
+            ('GET', '^queues$', self._queues),
+            ('POST', '^queues$', self._queues)
+        ]
+        self._routes = [(method, re.compile(pattern), handler)
+                        for method, pattern, handler in self._routes]
+
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d%s' % (host, port, API_ROOT.rstrip('/'))
+
+    def start(self):
+        girder = self
+
+        class Handler(_Handler):
+            pass
+        Handler.girder = girder
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _next_id(self):
+        with self._lock:
+            self._ids += 1
+            return _object_id(self._ids)
+
+    def add_image(self, repository, tag='latest'):
+        self.images[(repository, tag)] = {
+            '_id': self._next_id(),
+            'repository': repository,
+            'tag': tag,
+            'docker': {}
+        }
+
+    def add_molecules(self, count):
+        """Add count molecules with 3D coordinates, returns their InChIKeys."""
+        inchikeys = []
+        for _ in range(count):
+            _id = self._next_id()
+            inchikey = _inchikey(int(_id, 16))
+            self.molecules[_id] = {
+                '_id': _id,
+                'inchi': 'InChI=1S/benchmark/%s' % _id,
+                'inchikey': inchikey,
+                'smiles': 'O',
+                'name': 'molecule %s' % _id,
+                'cjson': _cjson()
+            }
+            self.inchikeys[inchikey] = _id
+            inchikeys.append(inchikey)
+
+        return inchikeys
+
+    def handle(self, method, path, query, body):
+        """
+        Route a request, returns the encoded response body and the time it
+        was last modified at, if it is known.
+        """
+        with self._lock:
+            self.requests[method] += 1
+
+        for route_method, pattern, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match:
+                result = handler(query, body, *match.groups())
+                last_modified = None
+                if isinstance(result, tuple):
+                    result, last_modified = result
+                if not isinstance(result, bytes):
+                    result = _encode(result)
+                return result, last_modified
+
+        raise RestError(404, 'No route for %s %s' % (method, path))
+
+    def _get_molecule(self, _id):
+        molecule = self.molecules.get(_id)
+        if molecule is None:
+            raise RestError(404, 'Molecule not found')
+
+        return molecule
+
+    def _find_molecules(self, query, body):
+        inchi = query.get('inchi')
+        results = [x for x in self.molecules.values() if x['inchi'] == inchi]
+        return {'results': results[:1]}
+
+    def _search_molecules(self, query, body):
+        _id = self.inchikeys.get(query.get('cactus'))
+        return {'results': [self.molecules[_id]] if _id else []}
+
+    def _molecule_by_inchikey(self, query, body, inchikey):
+        _id = self.inchikeys.get(inchikey)
+        if _id is None:
+            raise RestError(404, 'Molecule not found')
+
+        return self.molecules[_id]
+
+    def _molecule(self, query, body, _id):
+        return self._get_molecule(_id)
+
+    def _molecule_cjson(self, query, body, _id):
+        return self._get_molecule(_id)['cjson']
+
+    def _calculation_key(self, molecule_id, image_name, parameters,
+                         geometry_id):
+        return (molecule_id, image_name, json.dumps(parameters, sort_keys=True),
+                geometry_id)
+
+    def _find_calculations(self, query, body):
+        if 'moleculeId' not in query:
+            return self._list_calculations(query)
+
+        parameters = json.loads(urllib.parse.unquote(
+            query.get('inputParameters', 'null')))
+        key = self._calculation_key(query.get('moleculeId'),
+                                    query.get('imageName'), parameters,
+                                    query.get('geometryId'))
+        _id = self.calculation_keys.get(key)
+        results = [self._get_calculation(_id)] if _id else []
+
+        return {'results': results}
+
+    def _list_calculations(self, query):
+        calculations = [self._get_calculation(x)
+                        for x in list(self.calculations)]
+        if query.get('sort') == 'updated':
+            calculations.sort(key=lambda x: x['updated'],
+                              reverse=query.get('sortdir') == '-1')
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 50))
+
+        return {'results': calculations[offset:offset + limit]}
+
+    def _create_calculation(self, query, body):
+        image = body.get('image', {})
+        image_name = '%s:%s' % (image.get('repository'), image.get('tag'))
+        _id = self._next_id()
+        calculation = {
+            '_id': _id,
+            'moleculeId': body.get('moleculeId'),
+            'geometryId': body.get('geometryId'),
+            'image': image,
+            'input': body.get('input', {}),
+            'properties': body.get('properties', {}),
+            'notebooks': body.get('notebooks', []),
+            'updated': _now()
+        }
+        key = self._calculation_key(calculation['moleculeId'], image_name,
+                                    calculation['input'].get('parameters'),
+                                    calculation['geometryId'])
+        with self._lock:
+            self.calculations[_id] = calculation
+            self.calculation_keys[key] = _id
+
+        return calculation
+
+    def _get_calculation(self, _id):
+        calculation = self.calculations.get(_id)
+        if calculation is None:
+            raise RestError(404, 'Calculation not found')
+
+        properties = calculation['properties']
+        if properties.get('pending'):
+            taskflow_id = properties.get('taskFlowId')
+            if self._status(taskflow_id) == 'complete':
+                calculation['properties'] = {
+                    'pending': False,
+                    'totalEnergy': -76.0
+                }
+                calculation['updated'] = _now()
+
+        return calculation
+
+    def _calculation(self, query, body, _id):
+        return self._get_calculation(_id)
+
+    def _set_properties(self, query, body, _id):
+        calculation = self._get_calculation(_id)
+        calculation['properties'] = body
+        calculation['updated'] = _now()
+
+        return calculation
+
+    def _set_notebooks(self, query, body, _id):
+        calculation = self._get_calculation(_id)
+        calculation['notebooks'] = body.get('notebooks', [])
+        calculation['updated'] = _now()
+
+        return calculation
+
+    def _calculation_cjson(self, query, body, _id):
+        calculation = self._get_calculation(_id)
+        return self._cjson_body, _http_date(calculation['updated'])
+
+    def _calculation_vibrations(self, query, body, _id):
+        calculation = self._get_calculation(_id)
+        return self._vibrations_body, _http_date(calculation['updated'])
+
+    def _calculation_cube(self, query, body, _id, mo):
+        calculation = self._get_calculation(_id)
+        return self._cube_body, _http_date(calculation['updated'])
+
+    def _find_images(self, query, body):
+        image = self.images.get((query.get('repository'), query.get('tag')))
+        return {'results': [image] if image else []}
+
+    def _launch_taskflow(self, query, body):
+        _id = self._next_id()
+        calculation_ids = body['taskFlowInput']['input']['calculations']
+        with self._lock:
+            self.taskflows[_id] = {
+                'started': time.monotonic(),
+                'calculations': calculation_ids
+            }
+
+        return _id
+
+    def _status(self, taskflow_id):
+        taskflow = self.taskflows.get(taskflow_id)
+        if taskflow is None:
+            return None
+        if time.monotonic() - taskflow['started'] < self.run_time:
+            return 'running'
+
+        return 'complete'
+
+    def _taskflow_status(self, query, body, _id):
+        status = self._status(_id)
+        if status is None:
+            raise RestError(404, 'Taskflow not found')
+
+        return {'status': status}
+
+    def _queues(self, query, body):
+        running = {
+            _id: 'running' for _id in list(self.taskflows)
+            if self._status(_id) == 'running'
+        }
+        return [{'name': 'oc_queue', 'maxRunning': 5, 'taskflows': running}]
+
+def _encode(document):
+    return json.dumps(document).encode()
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep the connections alive, like the real server behind a proxy
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, don't let the delayed
+    # acknowledgements of the client stall every response
+    disable_nagle_algorithm = True
+    girder = None
+
+    def _handle(self, method):
+        url = urllib.parse.urlsplit(self.path)
+        path = url.path
+        if path.startswith(API_ROOT):
+            path = path[len(API_ROOT):]
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        body = json.loads(body) if body else {}
+
+        if self.girder.latency:
+            time.sleep(self.girder.latency)
+
+        headers = {}
+        try:
+            content, last_modified = self.girder.handle(
+                method, path.strip('/'), query, body)
+            status = 200
+        except RestError as ex:
+            content = _encode({'type': 'rest', 'message': str(ex)})
+            status = ex.status
+
+        if status == 200 and method == 'GET':
+            headers['ETag'] = _etag(content)
+            if last_modified is not None:
+                headers['Last-Modified'] = last_modified
+            if _not_modified(self.headers, headers['ETag'], last_modified):
+                with self.girder._lock:
+                    self.girder.not_modified += 1
+                status = 304
+                content = b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def log_message(self, format, *args):
+        pass
@@ -1,10 +1,74 @@
-from ._utils import (
-    hash_object, camel_to_space, parse_image_name, calculate_rmsd
-)
-from .io import (
-    CjsonReader, Cp2kReader, NWChemJsonReader, OrcaReader, Psi4Reader
-)
-from .api import (
-    load, find_structure, find_calculation, find_molecule, monitor, queue,
-    find_spectra, import_structure, run_calculations
-)
+"""Open Chemistry python client
+
+The public functions are loaded from their modules the first time they are
+accessed, so that importing the package does not pull in the heavy
+dependencies (avogadro, numpy, girder_client, IPython, ...) until they are
+actually needed.
+"""
+import importlib
+
+_lazy_attributes = {
+    '._utils': [
+        'hash_object', 'camel_to_space', 'parse_image_name', 'calculate_rmsd'
+    ],
+    '.io': [
+        'CjsonReader', 'Cp2kReader', 'NWChemJsonReader', 'OrcaReader',
+        'Psi4Reader'
+    ],
+    '.api': [
+        'load', 'find_structure', 'find_calculation', 'find_molecule',
+        'monitor', 'queue', 'find_spectra', 'import_structure',
+        'run_calculations'
+    ],
+    '._cache': [
+        'cube_cache_info', 'set_cube_cache_size', 'clear_cube_cache',
+        'enable_disk_cache', 'disable_disk_cache', 'clear_disk_cache'
+    ],
+    '._girder': [
+        'coalesced_requests'
+    ],
+    '._index': [
+        'enable_calculation_index', 'disable_calculation_index',
+        'sync_calculation_index', 'clear_calculation_index',
+        'calculation_index_info'
+    ],
+    '._metrics': [
+        'stats', 'profile'
+    ],
+    '._tracing': [
+        'enable_tracing', 'disable_tracing'
+    ],
+    '._wait': [
+        'wait', 'as_completed', 'wait_async', 'as_completed_async'
+    ]
+}
+
+_lazy_modules = {
+    name: module
+    for module, names in _lazy_attributes.items() for name in names
+}
+
+# Submodules available as attributes of the package, e.g. oc.aio
+_lazy_submodules = ['aio']
+
+__all__ = sorted(_lazy_modules)
+
+def __getattr__(name):
+    if name in _lazy_submodules:
+        value = importlib.import_module('.' + name, __name__)
+        globals()[name] = value
+        return value
+
+    module = _lazy_modules.get(name)
+    if module is None:
+        raise AttributeError(
+            'module %r has no attribute %r' % (__name__, name))
+
+    value = getattr(importlib.import_module(module, __name__), name)
+    # Cache it, so __getattr__ is not called again for this name
+    globals()[name] = value
+
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_modules) | set(_lazy_submodules))
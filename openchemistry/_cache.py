@@ -0,0 +1,369 @@
+import collections
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from ._singleton import Singleton
+from ._tracing import span
+
+# 512 MiB, can be overridden with the OC_CUBE_CACHE_SIZE environment variable
+DEFAULT_CUBE_CACHE_SIZE = 512 * 1024 ** 2
+
+def _cube_size(cube):
+    """Estimate the memory used by a cube, in bytes."""
+    scalars = cube.get('scalars', []) if isinstance(cube, dict) else cube
+    size = getattr(scalars, 'nbytes', None)
+    if size is None:
+        # A list of python floats: a pointer and a float object per value
+        size = sys.getsizeof(scalars) + len(scalars) * sys.getsizeof(0.0)
+
+    return size
+
+@Singleton
+class CubeCache(object):
+    """
+    Process-wide least recently used cache of volumetric data, bounded by
+    the total size of the cached cubes.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._max_size = int(os.environ.get('OC_CUBE_CACHE_SIZE',
+                                            DEFAULT_CUBE_CACHE_SIZE))
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def set(self, key, cube):
+        size = _cube_size(cube)
+        with self._lock:
+            self._discard(key)
+            if size > self._max_size:
+                # Never going to fit, don't flush the whole cache for it
+                return
+
+            self._entries[key] = (cube, size)
+            self._size += size
+            self._evict()
+
+    def resize(self, max_size):
+        with self._lock:
+            self._max_size = int(max_size)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'size': self._size,
+                'maxSize': self._max_size
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def _evict(self):
+        while self._size > self._max_size and self._entries:
+            _, (_, size) = self._entries.popitem(last=False)
+            self._size -= size
+            self._evictions += 1
+
+def cube_cache_info():
+    """
+    Statistics of the cube cache shared by all the molecules and calculations
+
+    Returns
+    -------
+    info : dict
+        The number of 'hits', 'misses' and 'evictions', the number of cached
+        'entries', their total 'size' and the 'maxSize' of the cache, in
+        bytes.
+    """
+    return CubeCache().info()
+
+def set_cube_cache_size(max_size):
+    """
+    Set the maximum size of the cube cache, in bytes. The least recently
+    used cubes are evicted if the cache no longer fits.
+    """
+    CubeCache().resize(max_size)
+
+def clear_cube_cache():
+    """Remove all the cubes from the cache."""
+    CubeCache().clear()
+
+# 2 GiB, can be overridden with the OC_DISK_CACHE_SIZE environment variable
+DEFAULT_DISK_CACHE_SIZE = 2 * 1024 ** 3
+
+# Seconds the documents that can't be revalidated are kept for, can be
+# overridden with the OC_DISK_CACHE_TTL environment variable. They are not
+# cached by default.
+DEFAULT_DISK_CACHE_TTL = 0
+
+@Singleton
+class DiskCache(object):
+    """
+    Persistent least recently used cache of JSON documents fetched from
+    Girder, bounded by the total size of the cached files.
+
+    Disabled unless OC_DISK_CACHE_DIR is set or enable_disk_cache() is
+    called.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._path = None
+        self._size = None
+        self._max_size = int(os.environ.get('OC_DISK_CACHE_SIZE',
+                                            DEFAULT_DISK_CACHE_SIZE))
+        self._ttl = float(os.environ.get('OC_DISK_CACHE_TTL',
+                                         DEFAULT_DISK_CACHE_TTL))
+
+        path = os.environ.get('OC_DISK_CACHE_DIR')
+        if path:
+            self.enable(path)
+
+    @property
+    def enabled(self):
+        return self._path is not None
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def enable(self, path=None, max_size=None, ttl=None):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache',
+                                'openchemistry')
+
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            self._path = path
+            self._size = None
+            if max_size is not None:
+                self._max_size = int(max_size)
+            if ttl is not None:
+                self._ttl = float(ttl)
+            self._evict()
+
+    def disable(self):
+        with self._lock:
+            self._path = None
+
+    def load(self, key):
+        filename = self._filename(key)
+        if filename is None:
+            return None
+
+        try:
+            with open(filename, 'r') as f, \
+                    span('json.decode', bytes=_file_size(filename)):
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('key') != key:
+            return None
+
+        _touch(filename)
+        return entry
+
+    def touch(self, key):
+        filename = self._filename(key)
+        if filename is not None:
+            _touch(filename)
+
+    def store(self, key, body, etag=None, last_modified=None,
+              immutable=False, expires=None):
+        entry = {
+            'key': key,
+            'etag': etag,
+            'lastModified': last_modified,
+            'immutable': immutable,
+            'expires': expires,
+            'body': body
+        }
+
+        with self._lock:
+            # The cache may have been disabled since the document was fetched
+            filename = self._filename(key)
+            if filename is None:
+                return
+
+            tmp_filename = '%s.%s.tmp' % (filename, threading.get_ident())
+            previous = self._file_size(filename)
+            with open(tmp_filename, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_filename, filename)
+
+            if self._size is not None:
+                self._size += self._file_size(filename) - previous
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for filename in self._files():
+                os.remove(filename)
+            self._size = 0
+
+    def _filename(self, key):
+        """The file of a key, or None if the cache is disabled."""
+        # Read the path once, disable() can be called from another thread
+        path = self._path
+        if path is None:
+            return None
+
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(path, '%s.json' % digest)
+
+    def _files(self):
+        if self._path is None:
+            return []
+
+        return [os.path.join(self._path, name)
+                for name in os.listdir(self._path) if name.endswith('.json')]
+
+    def _file_size(self, filename):
+        return _file_size(filename)
+
+    def _evict(self):
+        if self._size is None:
+            self._size = sum(self._file_size(f) for f in self._files())
+
+        if self._size <= self._max_size:
+            return
+
+        # Remove the least recently used files first
+        files = sorted(self._files(), key=_mtime)
+        for filename in files:
+            if self._size <= self._max_size:
+                break
+            self._size -= self._file_size(filename)
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+def _file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+def _touch(filename):
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return 0
+
+def cached_get(path, parameters=None, immutable=False):
+    """
+    GET a JSON document from Girder through the disk cache
+
+    Cached documents are revalidated with conditional requests, using the
+    ETag and Last-Modified headers returned by the server. Immutable
+    documents, such as the output of a completed calculation, are never
+    revalidated. Documents returned without either header can't be
+    revalidated, they are only cached if the cache has a TTL, and are reused
+    until it expires.
+    """
+    from ._girder import GirderClient
+
+    cache = DiskCache()
+    if not cache.enabled:
+        return GirderClient().get(path, parameters)
+
+    key = '%s/%s?%s' % (GirderClient().url, path.lstrip('/'),
+                        json.dumps(parameters, sort_keys=True))
+    entry = cache.load(key)
+    if entry is not None and (entry['immutable'] or
+                              time.time() < (entry.get('expires') or 0)):
+        return entry['body']
+
+    headers = {}
+    if entry is not None:
+        if entry['etag'] is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry['lastModified'] is not None:
+            headers['If-Modified-Since'] = entry['lastModified']
+
+    r = GirderClient().sendRestRequest('GET', path, parameters,
+                                       headers=headers, jsonResp=False)
+    if r.status_code == 304 and entry is not None:
+        return entry['body']
+
+    with span('json.decode', bytes=len(r.content)):
+        body = r.json()
+    if body is None:
+        return body
+
+    etag = r.headers.get('ETag')
+    last_modified = r.headers.get('Last-Modified')
+    expires = None
+    if not immutable and etag is None and last_modified is None:
+        # Would be downloaded again every time, unless it expires
+        if cache.ttl <= 0:
+            return body
+        expires = time.time() + cache.ttl
+
+    cache.store(key, body, etag, last_modified, immutable, expires)
+
+    return body
+
+def enable_disk_cache(path=None, max_size=None, ttl=None):
+    """
+    Cache the molecules and calculations fetched from the server on disk,
+    so that they are not downloaded again in new sessions.
+
+    Parameters
+    ----------
+    path : str
+        The cache directory, defaults to ~/.cache/openchemistry.
+    max_size : int
+        The maximum size of the cache in bytes, the least recently used
+        documents are removed first.
+    ttl : float
+        The seconds the documents that the server returns without an ETag or
+        Last-Modified header are reused for, they are not cached if 0.
+    """
+    DiskCache().enable(path, max_size, ttl)
+
+def disable_disk_cache():
+    """Stop using the disk cache, the cached documents are kept."""
+    DiskCache().disable()
+
+def clear_disk_cache():
+    """Remove all the documents from the disk cache."""
+    DiskCache().clear()
@@ -1,9 +1,9 @@
 import os
 import inspect
 import json
-from jsonpath_rw import parse
 import urllib
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from girder_client import HttpError
 
@@ -12,11 +12,16 @@ from ._jupyterhub import JupyterHub
 from ._cluster import Cluster
 from ._molecule import Molecule
 from ._data import MoleculeProvider, CalculationProvider
+from ._index import CalculationIndex
+from ._status import TaskflowStatusCache
 from ._utils import (
     fetch_or_create_queue, hash_object, parse_image_name, mol_has_3d_coords,
-    get_oc_token_obj
+    get_oc_token_obj, jsonpath, calculation_failed
 )
 
+# The default number of concurrent requests used for batch operations
+DEFAULT_MAX_WORKERS = 8
+
 class GirderMolecule(Molecule):
     '''
     Derived version that allows calculations to be initiated on using Girder
@@ -81,7 +86,11 @@ class GirderMolecule(Molecule):
 class CalculationResult(Molecule):
 
     def __init__(self, _id=None, properties=None, molecule_id=None):
-        super(CalculationResult, self).__init__(CalculationProvider(_id, molecule_id))
+        complete = (isinstance(properties, dict) and
+                    not properties.get('pending') and
+                    not properties.get('error'))
+        super(CalculationResult, self).__init__(
+            CalculationProvider(_id, molecule_id, complete))
         self._id = _id
         self._properties = properties
         self._molecule_id = molecule_id
@@ -90,6 +99,14 @@ class CalculationResult(Molecule):
     def data(self):
         return self._provider.cjson
 
+    @property
+    def error(self):
+        """The error of a failed calculation, None otherwise."""
+        if isinstance(self._properties, dict):
+            return self._properties.get('error')
+
+        return None
+
     @property
     def optimized_geometry_id(self):
         if not self._optimized_geometry_id:
@@ -154,14 +171,32 @@ class PendingCalculationResultWrapper(AttributeInterceptor):
             # Outside notebook just print message
             table = 'Pending calculations .... '
 
-        # Only intercept when the taskflow is not complete
+        # Only intercept when the taskflow is not complete, the status is
+        # shared with the other pending results and refreshed in batches
+        TaskflowStatusCache().register(taskflow_id)
         def intercept():
-            return _fetch_taskflow_status(taskflow_id) != 'complete'
+            return TaskflowStatusCache().status(taskflow_id) != 'complete'
 
         super(PendingCalculationResultWrapper, self).__init__(calculation,
                                                               table, intercept)
 
 def _fetch_calculation(molecule_id, image_name, input_parameters, geometry_id=None):
+    index = CalculationIndex()
+    if index.enabled:
+        found, calculation = index.lookup(molecule_id, image_name,
+                                          input_parameters, geometry_id)
+        if found:
+            return calculation
+
+    calculation = _query_calculation(molecule_id, image_name,
+                                     input_parameters, geometry_id)
+    if index.enabled:
+        index.record_lookup(molecule_id, image_name, input_parameters,
+                            geometry_id, calculation)
+
+    return calculation
+
+def _query_calculation(molecule_id, image_name, input_parameters, geometry_id=None):
     repository, tag = parse_image_name(image_name)
     input_params_quoted = urllib.parse.quote(json.dumps(input_parameters))
     parameters = {
@@ -174,10 +209,13 @@ def _fetch_calculation(molecule_id, image_name, input_parameters, geometry_id=No
         parameters['geometryId'] = geometry_id
 
     res = GirderClient().get('calculations', parameters)
-    if 'results' not in res or len(res['results']) < 1:
+    # The failed calculations are treated as missing, so they are recreated
+    results = [x for x in res.get('results', [])
+               if not calculation_failed(x)]
+    if len(results) < 1:
         return None
 
-    return res['results'][0]
+    return results[0]
 
 def _nersc():
     oc_token_obj = get_oc_token_obj()
@@ -222,9 +260,7 @@ def _submit_calculations(cluster_id, pending_calculation_ids, image_name,
     return GirderClient().post('launch_taskflow/launch', json=body)
 
 def _fetch_taskflow_status(taskflow_id):
-    r = GirderClient().get('taskflows/%s/status' % taskflow_id)
-
-    return r['status']
+    return TaskflowStatusCache().status(taskflow_id)
 
 def _ensure_image_on_server(repository, tag, container='docker', digest=None):
     params = {
@@ -243,11 +279,13 @@ def _ensure_image_on_server(repository, tag, container='docker', digest=None):
     if container not in images[0]:
         raise Exception('Container type not found in image')
 
-def _create_pending_calculation(molecule_id, image_name, input_parameters, geometry_id=None):
+def _create_pending_calculation(molecule_id, image_name, input_parameters,
+                                geometry_id=None, ensure_image=True):
     repository, tag = parse_image_name(image_name)
 
     # Verify that the image is on the server before going any further
-    _ensure_image_on_server(repository, tag)
+    if ensure_image:
+        _ensure_image_on_server(repository, tag)
 
     notebooks = []
     if JupyterHub().file is not None:
@@ -279,13 +317,69 @@ def _create_pending_calculation(molecule_id, image_name, input_parameters, geome
 
 def _delete_calculation(calculation_id):
     GirderClient().delete('calculations/%s' % calculation_id)
+    CalculationIndex().remove(calculation_id)
+
+def _map_ordered(func, items, max_workers=None, progress=None,
+                 description=''):
+    """Apply func to every item using a bounded pool of worker threads
+
+    Parameters
+    ----------
+    func : callable
+        The function to apply, it receives a single item.
+    items : list
+        The items to process.
+    max_workers : int
+        The maximum number of concurrent requests, defaults to
+        DEFAULT_MAX_WORKERS.
+    progress : bool or callable
+        If True print progress, if callable it is called with
+        (description, done, total) every time an item is processed.
+    description : str
+        The name of the stage being reported.
+
+    Returns
+    -------
+    results : list
+        The results, in the same order as items.
+    """
+    items = list(items)
+    total = len(items)
+    results = [None] * total
+    if total == 0:
+        return results
+
+    if max_workers is None:
+        max_workers = DEFAULT_MAX_WORKERS
+    max_workers = max(1, min(max_workers, total))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(func, item): i for i, item in enumerate(items)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            _report_progress(progress, description, done, total)
+
+    return results
+
+def _report_progress(progress, description, done, total):
+    if not progress:
+        return
+
+    if callable(progress):
+        progress(description, done, total)
+    elif done == total or done % max(1, total // 100) == 0:
+        end = '\n' if done == total else '\r'
+        print('%s: %s/%s' % (description, done, total), end=end)
 
 def _fetch_or_submit_calculations(molecule_ids, image_name, input_parameters,
                                   geometry_ids=None, run_parameters=None,
-                                  force=False):
+                                  force=False, max_workers=None,
+                                  progress=None):
 
     try:
-        _check_required_coords(molecule_ids, image_name)
+        _check_required_coords(molecule_ids, image_name, max_workers)
     except Exception as e:
         print(str(e))
         return []
@@ -293,49 +387,116 @@ def _fetch_or_submit_calculations(molecule_ids, image_name, input_parameters,
     if geometry_ids is None:
         geometry_ids = [None] * len(molecule_ids)
 
-    calculations = []
-    pending_calculations = []
-    for molecule_id, geometry_id in zip(molecule_ids, geometry_ids):
-        calculation = _fetch_calculation(molecule_id, image_name,
-                                         input_parameters, geometry_id)
-        if calculation is None or force:
-            calculation = _create_pending_calculation(molecule_id, image_name,
-                                                      input_parameters,
-                                                      geometry_id)
-            pending_calculations.append(calculation)
-        else:
-            # If we already have a calculation tag it with this notebooks id
-            notebooks = calculation.setdefault('notebooks', [])
-            if JupyterHub().file is not None:
-                notebooks.append(JupyterHub().file['_id'])
+    indices = list(range(len(molecule_ids)))
+    calculations = [None] * len(indices)
+    index = CalculationIndex()
 
-            body = {
-                'notebooks': notebooks
-            }
-            GirderClient().patch('calculations/%s/notebooks' %
-                                 calculation['_id'],
-                                 json=body)
-
-        calculations.append(calculation)
-
-    if len(pending_calculations) != 0:
-        calc_ids = [x['_id'] for x in pending_calculations]
-        taskflow_id = _submit_calculations(Cluster().id, calc_ids,
-                                           image_name, run_parameters)
-
-        for i, calculation in enumerate(pending_calculations):
-            # Patch calculation to include taskflow id
-            props = calculation['properties']
-            props['taskFlowId'] = taskflow_id
-            pending_calculations[i] = GirderClient().put(
-                'calculations/%s/properties' % calculation['_id'], json=props)
-            index = calculations.index(calculation)
-            calculations[index] = pending_calculations[i]
+    def fetch(i):
+        return _fetch_calculation(molecule_ids[i], image_name,
+                                  input_parameters, geometry_ids[i])
+
+    if not force:
+        unresolved = indices
+        if index.enabled:
+            # Answer as many lookups as possible locally, in one pass
+            found = index.lookup_many(molecule_ids, image_name,
+                                      input_parameters, geometry_ids)
+            unresolved = [i for i in indices if not found[i][0]]
+            for i in indices:
+                calculations[i] = found[i][1]
+
+        fetched = _map_ordered(fetch, unresolved, max_workers, progress,
+                               'Looking up calculations')
+        for i, calculation in zip(unresolved, fetched):
+            calculations[i] = calculation
+
+    existing = [i for i in indices if calculations[i] is not None]
+
+    notebook_id = None
+    if JupyterHub().file is not None:
+        notebook_id = JupyterHub().file['_id']
+
+    def add_notebook(i):
+        # If we already have a calculation tag it with this notebooks id
+        calculation = calculations[i]
+        notebooks = calculation.setdefault('notebooks', [])
+        if notebook_id is None or notebook_id in notebooks:
+            return
+        notebooks.append(notebook_id)
+
+        body = {
+            'notebooks': notebooks
+        }
+        try:
+            GirderClient().patch(
+                'calculations/%s/notebooks' % calculation['_id'], json=body)
+        except HttpError as ex:
+            if ex.status != 404 or not index.enabled:
+                raise
+            # Deleted since it was indexed, ask the server again
+            index.remove(calculation['_id'])
+            calculations[i] = fetch(i)
+            if calculations[i] is not None:
+                add_notebook(i)
+            return
+
+        if index.enabled:
+            index.add([calculation])
+
+    _map_ordered(add_notebook, existing, max_workers, progress,
+                 'Tagging calculations')
+
+    # The same molecule and geometry can appear more than once in a batch,
+    # create a single calculation for all of them
+    missing = {}
+    for i in indices:
+        if calculations[i] is None:
+            key = (molecule_ids[i], geometry_ids[i])
+            missing.setdefault(key, []).append(i)
+
+    if len(missing) == 0:
+        return calculations
+
+    # Verify that the image is on the server before going any further
+    repository, tag = parse_image_name(image_name)
+    _ensure_image_on_server(repository, tag)
+
+    def create(key):
+        molecule_id, geometry_id = key
+        return _create_pending_calculation(molecule_id, image_name,
+                                           input_parameters, geometry_id,
+                                           ensure_image=False)
+
+    pending_calculations = _map_ordered(create, list(missing), max_workers,
+                                        progress, 'Creating calculations')
+
+    calc_ids = [x['_id'] for x in pending_calculations]
+    taskflow_id = _submit_calculations(Cluster().id, calc_ids,
+                                       image_name, run_parameters)
+
+    def update(calculation):
+        # Patch calculation to include taskflow id
+        props = calculation['properties']
+        props['taskFlowId'] = taskflow_id
+        return GirderClient().put(
+            'calculations/%s/properties' % calculation['_id'], json=props)
+
+    pending_calculations = _map_ordered(update, pending_calculations,
+                                        max_workers, progress,
+                                        'Submitting calculations')
+
+    for duplicates, calculation in zip(missing.values(),
+                                       pending_calculations):
+        for i in duplicates:
+            calculations[i] = calculation
+
+    if index.enabled:
+        index.add(pending_calculations)
 
     return calculations
 
 def _calculation_result(calculation, molecule_id):
-    pending = parse('properties.pending').find(calculation)
+    pending = jsonpath('properties.pending').find(calculation)
     if pending:
         pending = pending[0].value
 
@@ -343,7 +504,7 @@ def _calculation_result(calculation, molecule_id):
                                molecule_id)
 
     if pending:
-        taskflow_id = parse('properties.taskFlowId').find(calculation)
+        taskflow_id = jsonpath('properties.taskFlowId').find(calculation)
         if taskflow_id:
             taskflow_id = taskflow_id[0].value
         else:
@@ -376,11 +537,12 @@ def _mol_has_3d_coords(mol_id):
 def _generate_3d_coords(mol_id):
     GirderClient().post('molecules/%s/3d' % mol_id)
 
-def _check_required_coords(mol_ids, image_name):
+def _check_required_coords(mol_ids, image_name, max_workers=None):
     raise_exception = False
     if _3d_coords_required(image_name):
-        for mol_id in mol_ids:
-            if not _mol_has_3d_coords(mol_id):
+        has_3d_coords = _map_ordered(_mol_has_3d_coords, mol_ids, max_workers)
+        for mol_id, has_coords in zip(mol_ids, has_3d_coords):
+            if not has_coords:
                 _generate_3d_coords(mol_id)
                 raise_exception = True
 
@@ -1,12 +1,12 @@
 from abc import ABC, abstractmethod
 import json
-import collections
-import avogadro
-import requests
+import itertools
 
 from ._girder import GirderClient
 from ._application import Application
-from ._utils import calculate_mo
+from ._cache import CubeCache, cached_get
+from ._tracing import span
+from ._utils import calculate_mo, calculate_mos
 
 from girder_client import HttpError
 
@@ -25,27 +25,26 @@ class DataProvider(ABC):
     def load_orbital(self, mo):
         pass
 
+    def load_orbitals(self, mos):
+        for mo in mos:
+            self.load_orbital(mo)
+
     @property
     @abstractmethod
     def url(self):
         pass
 
 class CachedDataProvider(DataProvider):
-    MAX_CACHED = 5
+    _keys = itertools.count()
 
     def __init__(self):
-        self._cached_volumes = collections.OrderedDict()
+        self._cache_key = ('provider', next(CachedDataProvider._keys))
 
     def _get_cached_volume(self, mo):
-        if mo in self._cached_volumes:
-            return self._cached_volumes[mo]
-        return None
+        return CubeCache().get((self._cache_key, mo))
 
     def _set_cached_volume(self, mo, cube):
-        keys = self._cached_volumes.keys()
-        if len(keys) >= self.MAX_CACHED:
-            del self._cached_volumes[next(iter(keys))]
-        self._cached_volumes[mo] = cube
+        CubeCache().set((self._cache_key, mo), cube)
 
 class CjsonProvider(CachedDataProvider):
     def __init__(self, cjson):
@@ -71,6 +70,15 @@ class CjsonProvider(CachedDataProvider):
         cjson = self.cjson
         cjson['cube'] = cube
 
+    def load_orbitals(self, mos):
+        # Evaluate the basis set once for all the orbitals not cached yet
+        missing = [mo for mo in mos
+                   if super(CjsonProvider, self)._get_cached_volume(mo) is None]
+        if missing:
+            cubes = calculate_mos(self.cjson, missing)
+            for mo, cube in zip(missing, cubes):
+                super(CjsonProvider, self)._set_cached_volume(mo, cube)
+
     @property
     def url(self):
         return None
@@ -85,16 +93,16 @@ class MoleculeProvider(CjsonProvider):
     def cjson(self):
         if self._cjson_ is None:
             # Try to update the cjson
-            self._cjson_ = GirderClient().get('molecules/%s/cjson' % self._id)
+            self._cjson_ = cached_get('molecules/%s/cjson' % self._id)
 
         return self._cjson_
 
     @property
     def svg(self):
         if self._svg_ is None:
-            resp = GirderClient().get('molecules/%s/svg' % self._id,
-                                      jsonResp=False)
-            self._svg_ = resp.content.decode('utf-8')
+            content = GirderClient().get_content('molecules/%s/svg' %
+                                                 self._id)
+            self._svg_ = content.decode('utf-8')
 
         return self._svg_
 
@@ -126,24 +134,31 @@ class MoleculeProvider(CjsonProvider):
         return '%s/molecules/%s' % (Application().url.rstrip('/'), self._id)
 
 class CalculationProvider(CachedDataProvider):
-    def __init__(self, calculation_id, molecule_id):
+    def __init__(self, calculation_id, molecule_id, complete=False):
         super(CalculationProvider, self).__init__()
+        # Share the cubes between all the results of the same calculation
+        self._cache_key = ('calculation', calculation_id)
         self._id = calculation_id
         self._molecule_id = molecule_id
+        # The output of a completed calculation never changes
+        self._complete = complete
         self._cjson_ = None
         self._vibrational_modes_ = None
 
     @property
     def cjson(self):
         if self._cjson_ is None:
-            self._cjson_ = GirderClient().get('calculations/%s/cjson' % self._id)
+            self._cjson_ = cached_get('calculations/%s/cjson' % self._id,
+                                      immutable=self._complete)
 
         return self._cjson_
 
     @property
     def vibrations(self):
         if self._vibrational_modes_ is None:
-            self._vibrational_modes_ = GirderClient().get('calculations/%s/vibrationalmodes' % self._id)
+            self._vibrational_modes_ = cached_get(
+                'calculations/%s/vibrationalmodes' % self._id,
+                immutable=self._complete)
 
         return self._vibrational_modes_
 
@@ -151,9 +166,10 @@ class CalculationProvider(CachedDataProvider):
         cube = super(CalculationProvider, self)._get_cached_volume(mo)
         if cube is None:
             try:
-                cube = GirderClient().get('calculations/%s/cube/%s' % (self._id, mo))['cube']
+                cube = cached_get('calculations/%s/cube/%s' % (self._id, mo),
+                                  immutable=self._complete)['cube']
                 super(CalculationProvider, self)._set_cached_volume(mo, cube)
-            except requests.HTTPError:
+            except HttpError:
                 import warnings
                 warnings.warn("No molecular orbital data was found for this calculation.")
                 return
@@ -172,7 +188,9 @@ class AvogadroProvider(CjsonProvider):
     @property
     def cjson(self):
         if self._cjson_ is None:
+            import avogadro
             conv = avogadro.io.FileFormatManager()
             cjson_str = conv.write_string(self._molecule, 'cjson')
-            self._cjson_ = json.loads(cjson_str)
+            with span('json.decode', bytes=len(cjson_str)):
+                self._cjson_ = json.loads(cjson_str)
         return self._cjson_
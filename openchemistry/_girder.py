@@ -1,11 +1,125 @@
+import copy
+import json
 import os
-from girder_client import GirderClient as GC
+import random
+import threading
+import time
 
+import requests
+from girder_client import GirderClient as GC, HttpError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ._metrics import record_request
 from ._singleton import Singleton
 from ._utils import get_oc_token_obj
 
+# The number of connections kept open to the server, can be overridden with
+# the OC_HTTP_POOL_SIZE environment variable
+DEFAULT_POOL_SIZE = 16
+
+# The number of times a failed idempotent request is retried, can be
+# overridden with the OC_HTTP_RETRIES environment variable
+DEFAULT_RETRIES = 3
+
+# The base of the exponential backoff between the retries, in seconds
+BACKOFF_FACTOR = 0.5
+
+# Transient errors of the server or of a proxy in front of it
+RETRY_STATUSES = [429, 502, 503, 504]
+
+# Only the requests that can safely be repeated are retried
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+
+class _JitteredRetry(Retry):
+    """Exponential backoff with full jitter, so that many threads hitting the
+    same failure don't retry in lockstep."""
+
+    def get_backoff_time(self):
+        backoff = super(_JitteredRetry, self).get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+def _retry_policy(retries):
+    kwargs = {
+        'total': retries,
+        'backoff_factor': BACKOFF_FACTOR,
+        'status_forcelist': RETRY_STATUSES,
+        # Let girder_client raise its usual HttpError on the last attempt
+        'raise_on_status': False
+    }
+    try:
+        return _JitteredRetry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return _JitteredRetry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+class _Call(object):
+    """
+    A GET in flight, shared by all the threads requesting it. The result is
+    never handed out once others joined, every caller gets its own copy.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+def _pooled_session(pool_size, retries=DEFAULT_RETRIES):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                          max_retries=_retry_policy(retries))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+class _InstrumentedClient(GC):
+    """
+    girder_client.GirderClient recording the metrics of every request. The
+    latency includes the download of the body, which happens after the
+    headers are parsed.
+    """
+
+    def sendRestRequest(self, method, path, parameters=None, data=None,
+                        files=None, json=None, headers=None, jsonResp=True,
+                        **kwargs):
+        stream = kwargs.get('stream', False)
+        response = None
+        start = time.perf_counter()
+        try:
+            response = super(_InstrumentedClient, self).sendRestRequest(
+                method, path, parameters, data=data, files=files, json=json,
+                headers=headers, jsonResp=False, **kwargs)
+            if not stream:
+                # Read the body in the timed block
+                response.content
+        except HttpError as ex:
+            response = getattr(ex, 'response', None)
+            raise
+        finally:
+            record_request(method, path, response,
+                           time.perf_counter() - start, stream)
+
+        if jsonResp:
+            return response.json()
+
+        return response
+
 @Singleton
 class GirderClient(object):
+    """
+    The connection to the Girder server, safe to use from several threads
+
+    Each thread gets its own girder_client.GirderClient, they all share the
+    authentication token and a pool of keep-alive connections. Idempotent
+    requests failing with a transient error are retried with a jittered
+    exponential backoff.
+
+    Identical GETs issued concurrently by several threads are coalesced in a
+    single request, each thread then gets its own copy of the result.
+    """
+
     def __init__(self):
         token_obj = get_oc_token_obj()
         url = token_obj.get('apiUrl')
@@ -16,17 +130,131 @@ class GirderClient(object):
         api_key = os.environ.get('OC_API_KEY', api_key)
         token = os.environ.get('GIRDER_TOKEN')
 
-        self.client = None
         self.url = url
         self.internal_url = internal_url
 
-        if internal_url is not None:
-            self.client = GC(apiUrl=internal_url)
+        self.pool_size = int(os.environ.get('OC_HTTP_POOL_SIZE',
+                                            DEFAULT_POOL_SIZE))
+        self.retries = int(os.environ.get('OC_HTTP_RETRIES', DEFAULT_RETRIES))
+        self._session = _pooled_session(self.pool_size, self.retries)
+        self._local = threading.local()
+        self._token = None
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.coalesced = 0
 
+        if internal_url is not None:
             if api_key is not None:
+                # Authenticate once, the token is shared by all the threads
                 self.client.authenticate(apiKey=api_key)
+                self._token = self.client.token
             elif token is not None:
+                self._token = token
                 self.client.token = token
 
+    @property
+    def client(self):
+        """The girder_client.GirderClient of the current thread."""
+        if self.internal_url is None:
+            return None
+
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = _InstrumentedClient(apiUrl=self.internal_url)
+            client._session = self._session
+            if self._token is not None:
+                client.token = self._token
+            self._local.client = client
+
+        return client
+
+    @property
+    def token(self):
+        if self.internal_url is None:
+            return None
+
+        return self.client.token
+
+    def get(self, path, parameters=None, jsonResp=True):
+        if not jsonResp:
+            # Raw responses can only be consumed once, see get_content
+            return self.client.get(path, parameters, jsonResp=jsonResp)
+
+        return self._coalesced('json', path, parameters,
+                               lambda: self.client.get(path, parameters))
+
+    def get_content(self, path, parameters=None):
+        """
+        The body of a non JSON response, as bytes. Identical requests are
+        coalesced like with get().
+        """
+        def fetch():
+            return self.client.get(path, parameters, jsonResp=False).content
+
+        return self._coalesced('content', path, parameters, fetch)
+
+    def _coalesced(self, kind, path, parameters, fetch):
+        key = (kind, path, json.dumps(parameters, sort_keys=True, default=str))
+        with self._in_flight_lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+            else:
+                call.followers += 1
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            # The callers are free to modify what they get
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fetch()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+                # Nobody can join anymore
+                followers = call.followers
+            call.done.set()
+
+        if followers:
+            # The followers are copying the shared result, keep it intact
+            return copy.deepcopy(call.result)
+
+        return call.result
+
+    def set_pool_size(self, pool_size):
+        """Set the maximum number of connections kept open to the server."""
+        self.pool_size = pool_size
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=_retry_policy(self.retries))
+        previous = set(self._session.adapters.values())
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+        # Release the connections of the replaced adapters, the requests
+        # still using them complete normally
+        for old in previous:
+            old.close()
+
+    def set_retries(self, retries):
+        """Set the number of times failed idempotent requests are retried."""
+        self.retries = retries
+        self.set_pool_size(self.pool_size)
+
     def __getattr__(self, name):
         return getattr(self.client, name)
+
+def coalesced_requests():
+    """
+    The number of GET requests that were not sent because an identical one
+    was already in flight.
+    """
+    return GirderClient().coalesced
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ._singleton import Singleton
+from ._utils import calculation_failed, hash_object, parse_image_name
+
+# Seconds a calculation is trusted not to exist, can be overridden with the
+# OC_CALCULATION_INDEX_TTL environment variable
+DEFAULT_NEGATIVE_TTL = 60
+
+# The number of calculations fetched per request when syncing
+SYNC_PAGE_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calculations (
+    id TEXT PRIMARY KEY,
+    molecule_id TEXT NOT NULL,
+    image TEXT NOT NULL,
+    parameters_hash TEXT NOT NULL,
+    geometry_id TEXT NOT NULL,
+    pending INTEGER NOT NULL,
+    updated TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS calculations_key
+    ON calculations (molecule_id, image, parameters_hash, geometry_id);
+CREATE TABLE IF NOT EXISTS missing (
+    molecule_id TEXT NOT NULL,
+    image TEXT NOT NULL,
+    parameters_hash TEXT NOT NULL,
+    geometry_id TEXT NOT NULL,
+    checked REAL NOT NULL,
+    PRIMARY KEY (molecule_id, image, parameters_hash, geometry_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _image(image_name):
+    return '%s:%s' % parse_image_name(image_name)
+
+def _calculation_key(calculation):
+    """The (molecule id, image, parameters hash, geometry id) of a
+    calculation document."""
+    image = calculation.get('image') or {}
+    parameters = (calculation.get('input') or {}).get('parameters')
+
+    return (calculation.get('moleculeId'),
+            '%s:%s' % (image.get('repository'), image.get('tag')),
+            hash_object(parameters), calculation.get('geometryId') or '')
+
+def _pending(calculation):
+    properties = calculation.get('properties')
+    return isinstance(properties, dict) and bool(properties.get('pending'))
+
+@Singleton
+class CalculationIndex(object):
+    """
+    Local SQLite index of the calculations of the Girder server
+
+    Calculations are indexed by molecule id, image, hash of the input
+    parameters and geometry id, so that checking whether a batch of
+    calculations has already been run does not need a request per
+    calculation. It is filled by the lookups and the submissions of this
+    client, and by sync() which fetches the calculations modified since the
+    last sync. Lookups that found nothing are remembered for a few seconds.
+
+    Pending calculations are never answered from the index, their status
+    has to come from the server. Failed calculations are not indexed.
+    Calculations deleted by other clients cannot be seen by sync(), they
+    are dropped when the server answers 404 for them (see remove()).
+
+    Disabled unless OC_CALCULATION_INDEX_DIR is set or
+    enable_calculation_index() is called.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._connection = None
+        self._path = None
+        self._negative_ttl = float(os.environ.get('OC_CALCULATION_INDEX_TTL',
+                                                  DEFAULT_NEGATIVE_TTL))
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+
+        path = os.environ.get('OC_CALCULATION_INDEX_DIR')
+        if path:
+            self.enable(path)
+
+    @property
+    def enabled(self):
+        return self._connection is not None
+
+    def enable(self, path=None, negative_ttl=None):
+        from ._girder import GirderClient
+
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.cache',
+                                'openchemistry')
+
+        # One index per server
+        url = GirderClient().url or ''
+        digest = hashlib.sha256(url.encode()).hexdigest()[:16]
+        filename = os.path.join(path, 'calculations-%s.sqlite' % digest)
+
+        with self._lock:
+            self.disable()
+            os.makedirs(path, exist_ok=True)
+            connection = sqlite3.connect(filename, check_same_thread=False)
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+            self._path = filename
+            if negative_ttl is not None:
+                self._negative_ttl = float(negative_ttl)
+
+    def disable(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+            self._connection = None
+            self._path = None
+
+    def lookup(self, molecule_id, image_name, input_parameters,
+               geometry_id=None):
+        """
+        Returns (found, calculation). If found is False the server has to
+        be asked, otherwise calculation is the matching calculation, or None
+        if it is known not to exist.
+        """
+        return self.lookup_many([molecule_id], image_name, input_parameters,
+                                [geometry_id])[0]
+
+    def lookup_many(self, molecule_ids, image_name, input_parameters,
+                    geometry_ids=None):
+        """lookup() for a batch of molecules sharing the same parameters."""
+        if geometry_ids is None:
+            geometry_ids = [None] * len(molecule_ids)
+
+        image = _image(image_name)
+        parameters_hash = hash_object(input_parameters)
+        expired = time.time() - self._negative_ttl
+
+        results = []
+        with self._lock:
+            for molecule_id, geometry_id in zip(molecule_ids, geometry_ids):
+                results.append(self._lookup(molecule_id, image,
+                                            parameters_hash,
+                                            geometry_id or '', expired))
+
+        return results
+
+    def _lookup(self, molecule_id, image, parameters_hash, geometry_id,
+                expired):
+        query = ('SELECT pending, document FROM calculations WHERE '
+                 'molecule_id = ? AND image = ? AND parameters_hash = ?')
+        args = [molecule_id, image, parameters_hash]
+        if geometry_id:
+            query += ' AND geometry_id = ?'
+            args.append(geometry_id)
+        # Like the server, any geometry matches when none is given, prefer
+        # the complete calculations then
+        row = self._connection.execute(query + ' ORDER BY pending LIMIT 1',
+                                       args).fetchone()
+
+        if row is not None:
+            pending, document = row
+            if pending:
+                self._misses += 1
+                return False, None
+            self._hits += 1
+            return True, json.loads(document)
+
+        row = self._connection.execute(
+            'SELECT checked FROM missing WHERE molecule_id = ? AND '
+            'image = ? AND parameters_hash = ? AND geometry_id = ?',
+            (molecule_id, image, parameters_hash, geometry_id)).fetchone()
+        if row is not None and row[0] > expired:
+            self._negative_hits += 1
+            return True, None
+
+        self._misses += 1
+        return False, None
+
+    def record_lookup(self, molecule_id, image_name, input_parameters,
+                      geometry_id, calculation):
+        """Store the answer of the server to a lookup."""
+        if calculation is not None:
+            self.add([calculation])
+            return
+
+        key = (molecule_id, _image(image_name),
+               hash_object(input_parameters), geometry_id or '')
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO missing VALUES (?, ?, ?, ?, ?)',
+                key + (time.time(),))
+
+    def add(self, calculations):
+        """
+        Add or update calculation documents, the failed ones are removed as
+        they have to be recreated.
+        """
+        rows = []
+        failed = []
+        for calculation in calculations:
+            if calculation_failed(calculation):
+                failed.append((calculation['_id'],))
+                continue
+            key = _calculation_key(calculation)
+            rows.append((calculation['_id'],) + key + (
+                int(_pending(calculation)), calculation.get('updated'),
+                json.dumps(calculation)))
+
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO calculations VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._connection.executemany(
+                'DELETE FROM calculations WHERE id = ?', failed)
+            # They exist now, whatever the geometry asked for
+            for row in rows:
+                self._connection.execute(
+                    'DELETE FROM missing WHERE molecule_id = ? AND '
+                    'image = ? AND parameters_hash = ? AND '
+                    'geometry_id IN (?, \'\')', row[1:5])
+
+    def remove(self, calculation_id):
+        if not self.enabled:
+            return
+
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM calculations WHERE id = ?',
+                                     (calculation_id,))
+
+    def sync(self):
+        """
+        Fetch the calculations modified since the last sync, the most
+        recently modified first. Returns the number of calculations
+        updated.
+        """
+        from ._girder import GirderClient
+
+        if not self.enabled:
+            return 0
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM meta WHERE key = ?', ('updated',)
+            ).fetchone()
+        watermark = row[0] if row else None
+        newest = watermark
+        count = 0
+        offset = 0
+
+        while True:
+            parameters = {
+                'sort': 'updated',
+                'sortdir': -1,
+                'limit': SYNC_PAGE_SIZE,
+                'offset': offset
+            }
+            page = GirderClient().get('calculations', parameters)
+            page = page.get('results', []) if isinstance(page, dict) else page
+
+            # Timestamps are ISO 8601 strings, they sort chronologically
+            modified = [x for x in page if watermark is None or
+                        (x.get('updated') or '') >= watermark]
+            self.add(modified)
+            count += len(modified)
+            for calculation in modified:
+                updated = calculation.get('updated')
+                if updated is not None and (newest is None or
+                                            updated > newest):
+                    newest = updated
+
+            if len(modified) < len(page) or len(page) < SYNC_PAGE_SIZE:
+                break
+            offset += len(page)
+
+        with self._lock, self._connection:
+            if newest is not None:
+                self._connection.execute(
+                    'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                    ('updated', newest))
+            self._connection.execute(
+                'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                ('synced', str(time.time())))
+
+        return count
+
+    def clear(self):
+        if not self.enabled:
+            return
+
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM calculations')
+            self._connection.execute('DELETE FROM missing')
+            self._connection.execute('DELETE FROM meta')
+
+    def info(self):
+        with self._lock:
+            info = {
+                'enabled': self.enabled,
+                'path': self._path,
+                'hits': self._hits,
+                'negativeHits': self._negative_hits,
+                'misses': self._misses,
+                'negativeTTL': self._negative_ttl
+            }
+            if not self.enabled:
+                return info
+
+            execute = self._connection.execute
+            info['calculations'] = execute(
+                'SELECT COUNT(*) FROM calculations').fetchone()[0]
+            info['missing'] = execute(
+                'SELECT COUNT(*) FROM missing').fetchone()[0]
+            synced = execute('SELECT value FROM meta WHERE key = ?',
+                             ('synced',)).fetchone()
+            info['lastSync'] = float(synced[0]) if synced else None
+
+            return info
+
+def enable_calculation_index(path=None, negative_ttl=None, sync=False):
+    """
+    Look up the calculations in a local index before asking the server, so
+    that checking large batches of calculations takes milliseconds.
+
+    Parameters
+    ----------
+    path : str
+        The directory of the index, defaults to ~/.cache/openchemistry.
+    negative_ttl : float
+        The number of seconds a calculation that was not found on the server
+        is assumed not to exist.
+    sync : bool
+        Fetch the calculations modified since the last sync right away.
+    """
+    CalculationIndex().enable(path, negative_ttl)
+    if sync:
+        CalculationIndex().sync()
+
+def disable_calculation_index():
+    """Always ask the server, the index is kept on disk."""
+    CalculationIndex().disable()
+
+def sync_calculation_index():
+    """
+    Fetch the calculations modified on the server since the last sync.
+    Returns the number of calculations added or updated.
+    """
+    return CalculationIndex().sync()
+
+def clear_calculation_index():
+    """Remove all the calculations from the index."""
+    CalculationIndex().clear()
+
+def calculation_index_info():
+    """
+    Statistics of the calculation index
+
+    Returns
+    -------
+    info : dict
+        Whether it is 'enabled', its 'path', the number of 'hits',
+        'negativeHits' and 'misses' of the lookups, the number of indexed
+        'calculations' and of 'missing' ones, the 'negativeTTL' and the time
+        of the 'lastSync'.
+    """
+    return CalculationIndex().info()
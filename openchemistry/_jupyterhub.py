@@ -1,4 +1,5 @@
 import os
+import threading
 
 from ._girder import GirderClient
 from ._singleton import Singleton
@@ -10,7 +11,19 @@ class JupyterHub(object):
     def __init__(self):
         url = os.environ.get('OC_JUPYTERHUB_URL')
         self.url = url
-        self.file = None
-        
-        if self.url is not None and GirderClient().client is not None:
-            self.file = lookup_file(GirderClient().client, self.url)
+        self._file = None
+        self._looked_up = False
+        self._lock = threading.Lock()
+
+    @property
+    def file(self):
+        # The notebook file is looked up the first time a calculation is
+        # tagged with it, then kept for the lifetime of the kernel.
+        if not self._looked_up:
+            with self._lock:
+                if not self._looked_up:
+                    if self.url is not None and GirderClient().client is not None:
+                        self._file = lookup_file(GirderClient().client, self.url)
+                    self._looked_up = True
+
+        return self._file
@@ -0,0 +1,213 @@
+import bisect
+import contextlib
+import copy
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+from ._singleton import Singleton
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                   float('inf')]
+
+_object_id_regex = re.compile('^[0-9a-f]{24}$')
+
+def endpoint_template(method, url):
+    """
+    The endpoint of a request, with the ids replaced by placeholders, e.g.
+    'GET molecules/{id}/cjson'.
+    """
+    path = urllib.parse.urlsplit(url).path
+    # Drop the location of the API
+    path = re.sub('^.*?/api/v[0-9]+/', '', path)
+
+    segments = []
+    previous = None
+    for segment in path.strip('/').split('/'):
+        if _object_id_regex.match(segment):
+            segment = '{id}'
+        elif previous == 'cube':
+            segment = '{mo}'
+        elif previous == 'inchikey':
+            segment = '{inchikey}'
+        segments.append(segment)
+        previous = segment
+
+    return '%s %s' % (method, '/'.join(segments))
+
+def _new_endpoint():
+    return {
+        'count': 0,
+        'errors': 0,
+        'bytesSent': 0,
+        'bytesReceived': 0,
+        'time': 0.0,
+        'histogram': [0] * len(LATENCY_BUCKETS)
+    }
+
+@Singleton
+class Metrics(object):
+    """Per-endpoint statistics of the requests sent to Girder."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, elapsed, sent, received, error):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = _new_endpoint()
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['bytesSent'] += sent
+            stats['bytesReceived'] += received
+            stats['time'] += elapsed
+            bucket = bisect.bisect_left(LATENCY_BUCKETS, elapsed * 1000)
+            stats['histogram'][bucket] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._endpoints)
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+def record_request(method, path, response, elapsed, stream=False):
+    """
+    Record the metrics of a request, response is None if none was received.
+    The body of streamed responses is not read, their size is taken from
+    the Content-Length header.
+    """
+    sent = received = 0
+    error = True
+    if response is not None:
+        body = response.request.body
+        if isinstance(body, (bytes, str)):
+            sent = len(body)
+        if stream:
+            received = int(response.headers.get('Content-Length', 0))
+        else:
+            received = len(response.content)
+        error = response.status_code >= 400
+
+    Metrics().record(endpoint_template(method.upper(), path), elapsed, sent,
+                     received, error)
+
+def _percentile(histogram, q):
+    """Upper bound of the bucket containing the q-th percentile, in ms."""
+    total = sum(histogram)
+    if total == 0:
+        return 0
+
+    count = 0
+    for bound, n in zip(LATENCY_BUCKETS, histogram):
+        count += n
+        if count >= total * q / 100:
+            return bound
+
+    return LATENCY_BUCKETS[-1]
+
+def _summarize(endpoints, coalesced):
+    summary = {}
+    for endpoint, stats in endpoints.items():
+        stats = dict(stats)
+        stats['p50'] = _percentile(stats['histogram'], 50)
+        stats['p90'] = _percentile(stats['histogram'], 90)
+        stats['p99'] = _percentile(stats['histogram'], 99)
+        summary[endpoint] = stats
+
+    return {
+        'requests': sum(x['count'] for x in endpoints.values()),
+        'time': sum(x['time'] for x in endpoints.values()),
+        'coalesced': coalesced,
+        'endpoints': summary
+    }
+
+def _coalesced():
+    from ._girder import GirderClient
+    return GirderClient().coalesced
+
+def stats(reset=False):
+    """
+    Statistics of the requests sent to the Girder server
+
+    Parameters
+    ----------
+    reset : bool
+        Clear the statistics after reading them.
+
+    Returns
+    -------
+    stats : dict
+        The total number of 'requests' and their 'time', the number of
+        'coalesced' requests that were not sent, and the statistics of each
+        endpoint: 'count', 'errors', 'bytesSent', 'bytesReceived', 'time' (in
+        seconds), the latency 'histogram' (see LATENCY_BUCKETS) and its
+        'p50', 'p90' and 'p99' (in milliseconds).
+    """
+    endpoints = Metrics().snapshot()
+    if reset:
+        Metrics().reset()
+
+    return _summarize(endpoints, _coalesced())
+
+def _difference(before, after):
+    endpoints = {}
+    for endpoint, stats in after.items():
+        previous = before.get(endpoint, _new_endpoint())
+        if stats['count'] == previous['count']:
+            continue
+        diff = {key: stats[key] - previous[key] for key in stats
+                if key != 'histogram'}
+        diff['histogram'] = [a - b for a, b in zip(stats['histogram'],
+                                                   previous['histogram'])]
+        endpoints[endpoint] = diff
+
+    return endpoints
+
+def format_stats(summary, elapsed=None):
+    lines = []
+    header = '%d requests, %.3f s' % (summary['requests'], summary['time'])
+    if elapsed is not None:
+        header += ' in %.3f s' % elapsed
+    header += ', %d coalesced' % summary['coalesced']
+    lines.append(header)
+
+    if summary['endpoints']:
+        lines.append('%-45s %7s %7s %10s %10s %8s %8s' % (
+            'endpoint', 'count', 'errors', 'KiB', 'time (s)', 'p50 (ms)',
+            'p90 (ms)'))
+    endpoints = sorted(summary['endpoints'].items(),
+                       key=lambda x: x[1]['time'], reverse=True)
+    for endpoint, stats in endpoints:
+        lines.append('%-45s %7d %7d %10.1f %10.3f %8g %8g' % (
+            endpoint, stats['count'], stats['errors'],
+            stats['bytesReceived'] / 1024, stats['time'], stats['p50'],
+            stats['p90']))
+
+    return '\n'.join(lines)
+
+@contextlib.contextmanager
+def profile(file=None):
+    """
+    Print a summary of the requests sent to the Girder server in the block,
+    with the most time consuming endpoints first.
+
+        with oc.profile():
+            oc.find_structure('caffeine').orbitals.show()
+    """
+    before = Metrics().snapshot()
+    coalesced = _coalesced()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        endpoints = _difference(before, Metrics().snapshot())
+        summary = _summarize(endpoints, _coalesced() - coalesced)
+        print(format_stats(summary, elapsed), file=file or sys.stdout)
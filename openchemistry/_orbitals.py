@@ -0,0 +1,324 @@
+"""Native evaluation of molecular orbitals on a regular grid
+
+The basis set and the molecular orbital coefficients are read directly from
+the 'basisSet' and 'orbitals' sections of a CJSON document, the Gaussian
+basis functions are evaluated with NumPy and contracted with the MO
+coefficients. Only the box of grid points close enough to an atom for its
+basis functions to contribute is evaluated.
+"""
+import math
+
+import numpy as np
+
+from ._tracing import annotate
+
+ANGSTROM_TO_BOHR = 1.8897261246257702
+
+# Values of a contracted shell smaller than this are neglected
+CUTOFF = 1e-10
+
+# The number of (x, y) grid points contracted at once, bounds the memory used
+CHUNK_SIZE = 4096
+
+_SQRT3 = math.sqrt(3)
+_SQRT15 = math.sqrt(15)
+
+# The angular part of the basis functions of each CJSON shell type, in the
+# order used by the MO coefficients. Each basis function is a list of
+# (coefficient, (lx, ly, lz)) terms, the coefficients are relative to the
+# normalization of a primitive xyz-like function, (2a/pi)^3/4 (4a)^L/2.
+_SHELLS = {
+    # S
+    0: [
+        [(1.0, (0, 0, 0))]
+    ],
+    # P: x, y, z
+    1: [
+        [(1.0, (1, 0, 0))],
+        [(1.0, (0, 1, 0))],
+        [(1.0, (0, 0, 1))]
+    ],
+    # Cartesian D: xx, yy, zz, xy, xz, yz
+    2: [
+        [(1 / _SQRT3, (2, 0, 0))],
+        [(1 / _SQRT3, (0, 2, 0))],
+        [(1 / _SQRT3, (0, 0, 2))],
+        [(1.0, (1, 1, 0))],
+        [(1.0, (1, 0, 1))],
+        [(1.0, (0, 1, 1))]
+    ],
+    # Spherical D: d0, d+1, d-1, d+2, d-2
+    -2: [
+        [(1 / _SQRT3, (0, 0, 2)), (-0.5 / _SQRT3, (2, 0, 0)),
+         (-0.5 / _SQRT3, (0, 2, 0))],
+        [(1.0, (1, 0, 1))],
+        [(1.0, (0, 1, 1))],
+        [(0.5, (2, 0, 0)), (-0.5, (0, 2, 0))],
+        [(1.0, (1, 1, 0))]
+    ],
+    # Cartesian F: xxx, yyy, zzz, xyy, xxy, xxz, xzz, yzz, yyz, xyz
+    3: [
+        [(1 / _SQRT15, (3, 0, 0))],
+        [(1 / _SQRT15, (0, 3, 0))],
+        [(1 / _SQRT15, (0, 0, 3))],
+        [(1 / _SQRT3, (1, 2, 0))],
+        [(1 / _SQRT3, (2, 1, 0))],
+        [(1 / _SQRT3, (2, 0, 1))],
+        [(1 / _SQRT3, (1, 0, 2))],
+        [(1 / _SQRT3, (0, 1, 2))],
+        [(1 / _SQRT3, (0, 2, 1))],
+        [(1.0, (1, 1, 1))]
+    ],
+    # Spherical F: f0, f+1, f-1, f+2, f-2, f+3, f-3
+    -3: [
+        [(1 / _SQRT15, (0, 0, 3)), (-1.5 / _SQRT15, (2, 0, 1)),
+         (-1.5 / _SQRT15, (0, 2, 1))],
+        [(4 * math.sqrt(3 / 8) / _SQRT15, (1, 0, 2)),
+         (-math.sqrt(3 / 8) / _SQRT15, (3, 0, 0)),
+         (-math.sqrt(3 / 8) / _SQRT15, (1, 2, 0))],
+        [(4 * math.sqrt(3 / 8) / _SQRT15, (0, 1, 2)),
+         (-math.sqrt(3 / 8) / _SQRT15, (2, 1, 0)),
+         (-math.sqrt(3 / 8) / _SQRT15, (0, 3, 0))],
+        [(0.5, (2, 0, 1)), (-0.5, (0, 2, 1))],
+        [(1.0, (1, 1, 1))],
+        [(math.sqrt(5 / 8) / _SQRT15, (3, 0, 0)),
+         (-3 * math.sqrt(5 / 8) / _SQRT15, (1, 2, 0))],
+        [(3 * math.sqrt(5 / 8) / _SQRT15, (2, 1, 0)),
+         (-math.sqrt(5 / 8) / _SQRT15, (0, 3, 0))]
+    ]
+}
+
+# Shell types whose basis functions avogadro.core.GaussianSetTools evaluates
+# differently: its spherical d0 is not proportional to 3z^2 - r^2 and its
+# cartesian F normalization factors are not in the order of the components,
+# so six of its basis functions do not have a unit norm. The functions above
+# all do, which is what the MO coefficients of the QM codes assume (see
+# benchmarks/bench_calculate_mo.py).
+AVOGADRO_MISMATCHED_SHELLS = frozenset([-2, 3])
+
+def grid_spacing(atom_count):
+    """Scale the grid spacing based on the size of the molecule."""
+    spacing = 0.30
+    if atom_count > 50:
+        spacing = 0.5
+    elif atom_count > 30:
+        spacing = 0.4
+    elif atom_count > 10:
+        spacing = 0.33
+
+    return spacing
+
+def grid_limits(coords, spacing, padding=4):
+    """
+    Compute the origin, the number of points and the spacing along each axis
+    of a grid enclosing the atoms (all in Angstrom).
+    """
+    lower = coords.min(axis=0) - padding
+    upper = coords.max(axis=0) + padding
+    dimensions = np.maximum((upper - lower) / spacing, 2).astype(int)
+    spacings = (upper - lower) / (dimensions - 1)
+
+    return lower, dimensions, spacings
+
+class Basis(object):
+    """A Gaussian basis set read from a CJSON document."""
+
+    def __init__(self, cjson):
+        basis = cjson['basisSet']
+        shell_types = basis['shellTypes']
+        primitives_per_shell = basis['primitivesPerShell']
+        shell_to_atom = basis['shellToAtomMap']
+        exponents = np.asarray(basis['exponents'], dtype=float)
+        coefficients = np.asarray(basis['coefficients'], dtype=float)
+
+        coords = np.asarray(cjson['atoms']['coords']['3d'], dtype=float)
+        self.coords = coords.reshape(-1, 3)
+
+        self.shells = []
+        offset = 0
+        first = 0
+        for shell_type, n_primitives, atom in zip(shell_types,
+                                                  primitives_per_shell,
+                                                  shell_to_atom):
+            if shell_type not in _SHELLS:
+                raise NotImplementedError(
+                    'Unsupported shell type: %s' % shell_type)
+
+            components = _SHELLS[shell_type]
+            l = abs(shell_type)
+            a = exponents[offset:offset + n_primitives]
+            c = coefficients[offset:offset + n_primitives]
+            # Fold the primitive normalization in the contraction coefficients
+            c = c * (2 * a / math.pi) ** 0.75 * (4 * a) ** (l / 2)
+
+            # The weight of each cartesian monomial in each basis function
+            monomials = {}
+            for i, terms in enumerate(components):
+                for factor, powers in terms:
+                    weights = monomials.setdefault(
+                        powers, np.zeros(len(components)))
+                    weights[i] += factor
+
+            self.shells.append({
+                'atom': atom,
+                'exponents': a,
+                'coefficients': c,
+                'monomials': list(monomials.items()),
+                'first': first,
+                'size': len(components),
+                'cutoff': _cutoff_radius(a, c, l)
+            })
+
+            offset += n_primitives
+            first += len(components)
+
+        self.size = first
+
+    @property
+    def atoms(self):
+        """The shells grouped by the atom they are centered on."""
+        atoms = {}
+        for shell in self.shells:
+            atoms.setdefault(shell['atom'], []).append(shell)
+
+        return atoms
+
+def _cutoff_radius(exponents, coefficients, l):
+    """Distance (in Bohr) beyond which a contracted shell is negligible."""
+    radius2 = 0.0
+    for a, c in zip(exponents, coefficients):
+        log_c = math.log(max(abs(c), 1e-300) / CUTOFF)
+        r2 = max(log_c, 0) / a
+        # Account for the polynomial part of the basis function
+        for _ in range(3):
+            r2 = max(log_c + l * 0.5 * math.log(max(r2, 1.0)), 0) / a
+        radius2 = max(radius2, r2)
+
+    return math.sqrt(radius2)
+
+def mo_coefficients(cjson, n_basis):
+    """
+    The MO coefficients as a (n_basis, n_mo) matrix, one column per
+    molecular orbital.
+    """
+    orbitals = cjson.get('orbitals', {})
+    coefficients = orbitals.get('moCoefficients')
+    if coefficients is None:
+        coefficients = orbitals.get('alphaCoefficients')
+    if coefficients is None:
+        raise NotImplementedError('No molecular orbital coefficients found')
+
+    coefficients = np.asarray(coefficients, dtype=float)
+    if coefficients.size % n_basis != 0:
+        raise ValueError('The MO coefficients do not match the basis set')
+
+    return coefficients.reshape(-1, n_basis).T
+
+def _atom_factors(shells, deltas, coefficients):
+    """
+    Gaussian primitives are separable on a regular grid, so every term of
+    the shells of one atom is the product of three 1D factors. Returns the
+    factors along each axis, shape (n_terms, n_points_along_axis), and the
+    weight of each term in each MO, shape (n_terms, n_mo).
+    """
+    factors = ([], [], [])
+    weights = []
+    for shell in shells:
+        a = shell['exponents']
+        block = coefficients[shell['first']:shell['first'] + shell['size']]
+        gaussians = [np.exp(-np.outer(a, d * d)) for d in deltas]
+        for powers, monomial_weights in shell['monomials']:
+            for axis in range(3):
+                factors[axis].append(
+                    gaussians[axis] * deltas[axis] ** powers[axis])
+            weights.append(np.outer(shell['coefficients'],
+                                    monomial_weights @ block))
+
+    return [np.concatenate(f) for f in factors], np.concatenate(weights)
+
+def calculate_cubes(cjson, mos, spacing=None, padding=4):
+    """
+    Evaluate several molecular orbitals on the same grid
+
+    The basis functions are evaluated once and contracted with all the
+    requested columns of the MO coefficient matrix.
+
+    Parameters
+    ----------
+    cjson : dict
+        A CJSON document containing 'basisSet' and 'orbitals'.
+    mos : list of int
+        The indices of the molecular orbitals.
+    spacing : float
+        The grid spacing in Angstrom, defaults to a value based on the
+        number of atoms.
+    padding : float
+        The distance in Angstrom between the atoms and the grid boundary.
+
+    Returns
+    -------
+    grid : dict
+        The 'origin', 'spacing' and 'dimensions' of the grid.
+    scalars : numpy.ndarray
+        A (len(mos), n_points) array, the points are ordered with z varying
+        fastest.
+    """
+    basis = Basis(cjson)
+    coefficients = mo_coefficients(cjson, basis.size)
+    coefficients = coefficients[:, list(mos)]
+
+    if spacing is None:
+        spacing = grid_spacing(len(basis.coords))
+    origin, dimensions, spacings = grid_limits(basis.coords, spacing,
+                                               padding)
+
+    axes = [(origin[i] + spacings[i] * np.arange(dimensions[i])) *
+            ANGSTROM_TO_BOHR for i in range(3)]
+    centers = basis.coords * ANGSTROM_TO_BOHR
+    scalars = np.zeros((len(mos),) + tuple(dimensions))
+
+    for atom, shells in basis.atoms.items():
+        center = centers[atom]
+        cutoff = max(shell['cutoff'] for shell in shells)
+
+        # Only visit the box of grid points within the cutoff of the atom
+        box = []
+        for axis, c in zip(axes, center):
+            start = np.searchsorted(axis, c - cutoff)
+            stop = np.searchsorted(axis, c + cutoff, side='right')
+            box.append(slice(start, stop))
+        if any(b.start == b.stop for b in box):
+            continue
+
+        deltas = [axis[b] - c for axis, b, c in zip(axes, box, center)]
+        (x, y, z), weights = _atom_factors(shells, deltas, coefficients)
+
+        # Contract the terms with a single matrix product:
+        # (x * y)^T @ (weights * z) -> (nx * ny, n_mo * nz)
+        zw = (weights[:, :, None] * z[:, None, :]).reshape(len(z), -1)
+        ny = y.shape[1]
+        rows = max(1, CHUNK_SIZE // ny)
+        for begin in range(0, x.shape[1], rows):
+            xy = x[:, begin:begin + rows, None] * y[:, None, :]
+            values = xy.reshape(len(xy), -1).T @ zw
+            values = values.reshape(-1, ny, len(mos), z.shape[1])
+            start = box[0].start + begin
+            target = (slice(None), slice(start, start + len(values)),
+                      box[1], box[2])
+            scalars[target] += values.transpose(2, 0, 1, 3)
+
+    annotate(basisSize=basis.size, points=int(np.prod(dimensions)))
+
+    grid = {
+        'origin': origin.tolist(),
+        'spacing': spacings.tolist(),
+        'dimensions': dimensions.tolist()
+    }
+
+    return grid, scalars.reshape(len(mos), -1)
+
+def calculate_cube(cjson, mo, spacing=None, padding=4):
+    """Evaluate a single molecular orbital, see calculate_cubes."""
+    grid, scalars = calculate_cubes(cjson, [mo], spacing, padding)
+
+    return grid, scalars[0]
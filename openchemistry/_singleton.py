@@ -1,9 +1,21 @@
+import threading
+
 class Singleton(object):
     """Singleton decorator
+
+    The instance is created the first time it is requested, not when the
+    class is decorated, so importing a module never triggers any work done
+    in the constructor.
     """
     def __init__(self, cls):
         self._cls = cls
-        self._instance = self._cls()
+        self._instance = None
+        self._lock = threading.Lock()
 
     def __call__(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._cls()
+
         return self._instance
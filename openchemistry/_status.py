@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from girder_client import HttpError
+
+from ._girder import GirderClient
+from ._singleton import Singleton
+
+# Seconds a status is trusted for, can be overridden with the OC_STATUS_TTL
+# environment variable
+DEFAULT_STATUS_TTL = 5
+
+# The number of concurrent requests used to refresh the statuses
+STATUS_WORKERS = 8
+
+# Taskflows in these states never change again
+FINAL_STATUSES = ['complete', 'error', 'unexpectederror', 'terminated']
+
+@Singleton
+class TaskflowStatusCache(object):
+    """
+    Process-wide cache of taskflow statuses
+
+    A status is trusted for a few seconds, a final status forever. When a
+    status has to be refreshed, the statuses of all the outstanding
+    taskflows are refreshed together, so that accessing many pending results
+    in a row only costs a single round of requests.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._polled = threading.Condition(self._lock)
+        self._polling = False
+        self._statuses = {}
+        self._outstanding = set()
+        self._ttl = float(os.environ.get('OC_STATUS_TTL', DEFAULT_STATUS_TTL))
+        self._requests = 0
+
+    def register(self, taskflow_id):
+        """Refresh the status of this taskflow along with the others."""
+        with self._lock:
+            if self._final(taskflow_id) is None:
+                self._outstanding.add(taskflow_id)
+
+    def status(self, taskflow_id):
+        with self._lock:
+            status = self._fresh(taskflow_id)
+            if status is not None:
+                return status
+
+            self._outstanding.add(taskflow_id)
+
+        self.refresh()
+
+        return self.cached(taskflow_id)
+
+    def refresh(self, taskflow_ids=None):
+        """
+        Refresh the statuses of the given taskflows, by default all the
+        outstanding ones whose status has expired.
+        """
+        with self._lock:
+            # Only one refresh polls the server at a time, the others wait for
+            # its statuses and only poll for what is still missing
+            while self._polling:
+                self._polled.wait()
+
+            if taskflow_ids is None:
+                taskflow_ids = [x for x in self._outstanding
+                                if self._fresh(x) is None]
+            else:
+                taskflow_ids = [x for x in taskflow_ids
+                                if self._final(x) is None]
+
+            if not taskflow_ids:
+                return {}
+
+            self._polling = True
+
+        # The lock is not held while polling, so that the cached statuses
+        # stay available
+        statuses = {}
+        try:
+            statuses = self._poll(taskflow_ids)
+        finally:
+            with self._lock:
+                now = time.monotonic()
+                for taskflow_id, status in statuses.items():
+                    self._statuses[taskflow_id] = (status, now)
+                    if status in FINAL_STATUSES:
+                        self._outstanding.discard(taskflow_id)
+
+                self._polling = False
+                self._polled.notify_all()
+
+        return statuses
+
+    def cached(self, taskflow_id):
+        """The last known status of a taskflow, without any request."""
+        with self._lock:
+            return self._statuses.get(taskflow_id, (None, 0))[0]
+
+    def clear(self):
+        with self._lock:
+            self._statuses.clear()
+            self._outstanding.clear()
+
+    def info(self):
+        with self._lock:
+            return {
+                'outstanding': len(self._outstanding),
+                'cached': len(self._statuses),
+                'requests': self._requests
+            }
+
+    def _final(self, taskflow_id):
+        status, _ = self._statuses.get(taskflow_id, (None, 0))
+        return status if status in FINAL_STATUSES else None
+
+    def _fresh(self, taskflow_id):
+        status, timestamp = self._statuses.get(taskflow_id, (None, 0))
+        if status in FINAL_STATUSES:
+            return status
+        if status is not None and time.monotonic() - timestamp < self._ttl:
+            return status
+
+        return None
+
+    def _poll(self, taskflow_ids):
+        statuses = {}
+
+        # A single request tells which taskflows are still waiting in the
+        # queue, they can't be complete
+        try:
+            self._requests += 1
+            queues = GirderClient().get('queues', parameters={'name': 'oc_queue'})
+            queued = queues[0].get('taskflows', {}) if queues else {}
+        except HttpError:
+            queued = {}
+
+        remaining = []
+        for taskflow_id in taskflow_ids:
+            if queued.get(taskflow_id) == 'pending':
+                statuses[taskflow_id] = 'pending'
+            else:
+                remaining.append(taskflow_id)
+
+        def fetch(taskflow_id):
+            try:
+                r = GirderClient().get('taskflows/%s/status' % taskflow_id)
+            except HttpError:
+                return None
+            return r['status']
+
+        if remaining:
+            self._requests += len(remaining)
+            with ThreadPoolExecutor(min(STATUS_WORKERS,
+                                        len(remaining))) as executor:
+                for taskflow_id, status in zip(remaining,
+                                               executor.map(fetch, remaining)):
+                    if status is not None:
+                        statuses[taskflow_id] = status
+
+        return statuses
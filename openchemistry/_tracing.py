@@ -0,0 +1,222 @@
+"""Optional tracing of the compute heavy code paths
+
+Spans record the wall time of a block, some attributes describing the size
+of its input (atoms, basis functions, grid points, ...) and optionally its
+peak memory allocation. They are emitted to a JSON lines file and/or a
+callback. When tracing is disabled, the spans cost a single global check.
+
+    oc.enable_tracing('trace.jsonl', memory=True)
+    mol.orbitals.show(mo='homo')
+    oc.disable_tracing()
+"""
+import functools
+import json
+import threading
+import time
+
+_enabled = False
+_memory = False
+_owns_tracemalloc = False
+_emitters = []
+_local = threading.local()
+
+class _NoopSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span(object):
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self._peak = 0
+        self._allocated = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        stack = _stack()
+        if _memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._allocated = current
+        stack.append(self)
+        self._start = time.time()
+        self._clock = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._clock
+        stack = _stack()
+        stack.pop()
+
+        record = {
+            'name': self.name,
+            'start': self._start,
+            'duration': duration,
+            'thread': threading.get_ident()
+        }
+        if _memory and self._allocated is not None:
+            import tracemalloc
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._peak)
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            record['peakAllocation'] = max(peak - self._allocated, 0)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.attributes)
+
+        for emit in list(_emitters):
+            emit(record)
+
+        return False
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    return stack
+
+def span(name, **attributes):
+    """A context manager tracing the enclosed block."""
+    if not _enabled:
+        return _NOOP_SPAN
+
+    return Span(name, attributes)
+
+def annotate(**attributes):
+    """Add attributes to the innermost span of the current thread."""
+    if not _enabled:
+        return
+
+    stack = _stack()
+    if stack:
+        stack[-1].attributes.update(attributes)
+
+def traced(name=None, attributes=None, result=None):
+    """
+    Decorator tracing every call of a function
+
+    Parameters
+    ----------
+    name : str
+        The name of the span, defaults to the qualified name of the function.
+    attributes : callable
+        Called with the arguments of the function, returns a dict of
+        attributes. Only called when tracing is enabled.
+    result : callable
+        Called with the return value of the function, returns a dict of
+        attributes. Only called when tracing is enabled.
+    """
+    def decorator(func):
+        span_name = name or '%s.%s' % (func.__module__, func.__qualname__)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            attrs = attributes(*args, **kwargs) if attributes else {}
+            with Span(span_name, attrs) as s:
+                value = func(*args, **kwargs)
+                if result is not None:
+                    s.attributes.update(result(value))
+
+            return value
+
+        return wrapper
+
+    return decorator
+
+class _JsonLinesEmitter(object):
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def cjson_attributes(cjson):
+    """The size of a CJSON document, as span attributes."""
+    if not isinstance(cjson, dict):
+        return {}
+
+    attributes = {
+        'atoms': len(cjson.get('atoms', {}).get('elements', {})
+                     .get('number', []))
+    }
+    basis = cjson.get('basisSet')
+    if basis:
+        attributes['shells'] = len(basis.get('shellTypes', []))
+
+    return attributes
+
+def enable_tracing(path=None, callback=None, memory=False):
+    """
+    Start tracing the compute heavy functions
+
+    Parameters
+    ----------
+    path : str
+        Append the spans to this JSON lines file.
+    callback : callable
+        Called with the dict of every span.
+    memory : bool
+        Record the peak memory allocated in each span with tracemalloc, this
+        slows down the traced code significantly.
+    """
+    global _enabled, _memory, _owns_tracemalloc
+
+    disable_tracing()
+
+    if path is not None:
+        _emitters.append(_JsonLinesEmitter(path))
+    if callback is not None:
+        _emitters.append(callback)
+
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _owns_tracemalloc = True
+    _memory = memory
+    _enabled = bool(_emitters)
+
+def disable_tracing():
+    """Stop tracing, and close the JSON lines file if any."""
+    global _enabled, _memory, _owns_tracemalloc
+
+    _enabled = False
+    if _owns_tracemalloc:
+        import tracemalloc
+        tracemalloc.stop()
+    _memory = False
+    _owns_tracemalloc = False
+
+    for emit in _emitters:
+        close = getattr(emit, 'close', None)
+        if close is not None:
+            close()
+    del _emitters[:]
@@ -1,15 +1,24 @@
 import os
-import requests
 import re
 import json
 import hashlib
+import functools
+import importlib.util
 
-import avogadro
-import rmsd
-import numpy as np
+from ._tracing import annotate, cjson_attributes, span, traced
 
-from jsonpath_rw import parse
-from IPython.lib import kernel
+# The heavy dependencies (avogadro, numpy, rmsd, jsonpath_rw, IPython,
+# requests) are imported by the functions that need them, so that importing
+# openchemistry stays cheap.
+
+@functools.lru_cache(maxsize=None)
+def jsonpath(expression):
+    """
+    The compiled jsonpath_rw expression, jsonpath_rw.parse builds a new
+    parser every time it is called, which takes milliseconds.
+    """
+    from jsonpath_rw import parse
+    return parse(expression)
 
 def fetch_or_create_queue(girder_client):
     params = {'name': 'oc_queue'}
@@ -28,6 +37,9 @@ def lookup_file(girder_client, jupyterhub_url):
     Utility function to lookup the Girder file that the current notebook is running
     from.
     """
+    import requests
+    from IPython.lib import kernel
+
     connection_file_path = kernel.get_connection_file()
     me = girder_client.get('user/me')
     login = me['login']
@@ -55,7 +67,7 @@ def lookup_file(girder_client, jupyterhub_url):
 
     return girder_client.resourceLookup('user/%s/Private/oc/notebooks/%s/%s' % (login, path, name))
 
-def calculate_mo(cjson, mo):
+def _mo_index(cjson, mo):
     if isinstance(mo, str):
         mo = mo.lower()
         if mo.lower() in ['homo', 'lumo']:
@@ -67,7 +79,7 @@ def calculate_mo(cjson, mo):
             ]
             matches = []
             for expr in path_expressions:
-                matches.extend(parse(expr).find(cjson))
+                matches.extend(jsonpath(expr).find(cjson))
             if len(matches) > 0:
                 electron_count = matches[0].value
             else:
@@ -82,25 +94,125 @@ def calculate_mo(cjson, mo):
         else:
             raise ValueError('Unsupported mo: %s' % mo)
 
+    return mo
+
+@traced('calculate_mo',
+        lambda cjson, mo, engine='auto': dict(cjson_attributes(cjson),
+                                              mo=mo, engine=engine))
+def calculate_mo(cjson, mo, engine='auto'):
+    """
+    Calculate a molecular orbital on a grid enclosing the molecule
+
+    Parameters
+    ----------
+    cjson : dict
+        A CJSON document containing 'basisSet' and 'orbitals'.
+    mo : int or str
+        The index of the molecular orbital, or 'homo' / 'lumo'.
+    engine : str
+        'numpy' evaluates the basis set natively, 'avogadro' uses
+        avogadro.core.GaussianSetTools. 'auto' uses the native engine and
+        falls back to avogadro when the basis set is not supported or does
+        not match the MO coefficients, or when it has spherical D or
+        cartesian F shells, on which the two engines disagree (see
+        _orbitals.AVOGADRO_MISMATCHED_SHELLS).
+
+    Returns
+    -------
+    cube : dict
+        The 'origin', 'spacing', 'dimensions' and 'scalars' of the cube.
+    """
+    mo = _mo_index(cjson, mo)
+
+    if engine not in ['auto', 'numpy', 'avogadro']:
+        raise ValueError('Unsupported engine: %s' % engine)
+
+    if _native_engine(cjson, engine):
+        try:
+            return _calculate_mo_numpy(cjson, mo)
+        except (NotImplementedError, KeyError, ValueError):
+            if engine == 'numpy':
+                raise
+
+    return _calculate_mo_avogadro(cjson, mo)
+
+@traced('calculate_mos',
+        lambda cjson, mos, engine='auto': dict(cjson_attributes(cjson),
+                                               mos=len(mos), engine=engine))
+def calculate_mos(cjson, mos, engine='auto'):
+    """
+    Calculate several molecular orbitals on the same grid
+
+    The basis set is evaluated once and contracted with all the requested
+    MO coefficients, so each additional orbital costs little more than a
+    matrix multiplication. See calculate_mo for the parameters.
+
+    Returns
+    -------
+    cubes : list of dict
+        One cube per requested orbital, in the same order as mos.
+    """
+    mos = [_mo_index(cjson, mo) for mo in mos]
+
+    if engine not in ['auto', 'numpy', 'avogadro']:
+        raise ValueError('Unsupported engine: %s' % engine)
+
+    if _native_engine(cjson, engine):
+        try:
+            from ._orbitals import calculate_cubes
+            grid, scalars = calculate_cubes(cjson, mos)
+            return [dict(grid, scalars=s.tolist()) for s in scalars]
+        except (NotImplementedError, KeyError, ValueError):
+            if engine == 'numpy':
+                raise
+
+    return [_calculate_mo_avogadro(cjson, mo) for mo in mos]
+
+def _native_engine(cjson, engine):
+    """Whether the native engine should be tried first."""
+    if engine != 'auto':
+        return engine == 'numpy'
+
+    from ._orbitals import AVOGADRO_MISMATCHED_SHELLS
+
+    shell_types = cjson.get('basisSet', {}).get('shellTypes', [])
+    if AVOGADRO_MISMATCHED_SHELLS.isdisjoint(shell_types):
+        return True
+
+    # Keep producing the same cubes as avogadro for these basis sets, unless
+    # it is not installed
+    return importlib.util.find_spec('avogadro') is None
+
+def _calculate_mo_numpy(cjson, mo):
+    from ._orbitals import calculate_cube
+
+    grid, scalars = calculate_cube(cjson, mo)
+    grid['scalars'] = scalars.tolist()
+
+    return grid
+
+def _calculate_mo_avogadro(cjson, mo):
+    import avogadro
+    from ._orbitals import grid_spacing
+
     mol = avogadro.core.Molecule()
     conv = avogadro.io.FileFormatManager()
     conv.read_string(mol, json.dumps(cjson), 'cjson')
     # Do some scaling of our spacing based on the size of the molecule.
-    atom_count = mol.atom_count()
-    spacing = 0.30
-    if atom_count > 50:
-        spacing = 0.5
-    elif atom_count > 30:
-        spacing = 0.4
-    elif atom_count > 10:
-        spacing = 0.33
+    spacing = grid_spacing(mol.atom_count())
     cube = mol.add_cube()
     # Hard wiring spacing/padding for now, this could be exposed in future too.
     cube.set_limits(mol, spacing, 4)
     gaussian = avogadro.core.GaussianSetTools(mol)
-    gaussian.calculate_molecular_orbital(cube, mo)
+    with span('avogadro.calculate_molecular_orbital', mo=mo):
+        gaussian.calculate_molecular_orbital(cube, mo)
 
-    return json.loads(conv.write_string(mol, "cjson"))['cube']
+    cjson_str = conv.write_string(mol, "cjson")
+    with span('json.decode', bytes=len(cjson_str)):
+        cube = json.loads(cjson_str)['cube']
+    annotate(points=len(cube.get('scalars', [])))
+
+    return cube
 
 def hash_object(obj):
     return hashlib.sha512(json.dumps(obj, sort_keys=True).encode()).hexdigest()
@@ -140,7 +252,7 @@ def cjson_has_3d_coords(cjson):
     # jsonpath_rw won't let us parse "3d" because it has
     # issues parsing keys that start with a number...
     # If this changes in the future, fix this
-    coords = parse('atoms.coords').find(cjson)
+    coords = jsonpath('atoms.coords').find(cjson)
     if (coords and '3d' in coords[0].value and
         len(coords[0].value['3d']) > 0):
         return True
@@ -150,6 +262,14 @@ def mol_has_3d_coords(mol):
     # This functions properly if passed None
     return cjson_has_3d_coords(mol.get('cjson'))
 
+def calculation_failed(calculation):
+    """
+    Whether the taskflow recorded an error for a calculation, it has no
+    output and is resubmitted like a missing calculation.
+    """
+    properties = calculation.get('properties')
+    return isinstance(properties, dict) and bool(properties.get('error'))
+
 def get_oc_token_obj():
     import base64
     try:
@@ -158,9 +278,13 @@ def get_oc_token_obj():
     except (TypeError, json.JSONDecodeError, Exception):
         return {}
 
+@traced('calculate_rmsd')
 def calculate_rmsd(mol_id, geometry_id1=None, geometry_id2=None,
                    heavy_atoms_only=False):
 
+    import numpy as np
+    import rmsd
+
     # These cause circular import errors if we put them at the top of the file
     from ._girder import GirderClient
     from ._calculation import GirderMolecule
@@ -189,6 +313,8 @@ def calculate_rmsd(mol_id, geometry_id1=None, geometry_id2=None,
     coords2_triplets = zip(coords2[0::3], coords2[1::3], coords2[2::3])
     B = np.array([x for x in coords2_triplets])
 
+    annotate(atoms=len(A), heavyAtomsOnly=heavy_atoms_only)
+
     if heavy_atoms_only:
         atomic_numbers = cjson1['atoms']['elements']['number']
         heavy_indices = [i for i, n in enumerate(atomic_numbers) if n != 1]
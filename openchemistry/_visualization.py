@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 import urllib.parse
 
 from ._girder import GirderClient
+from ._tracing import traced
 from ._utils import hash_object, camel_to_space, cjson_has_3d_coords
 
 class Visualization(ABC):
@@ -166,6 +167,9 @@ class Vibrations(Visualization):
             # Outside notebook print CJSON
             print(vibrations)
 
+    @traced('md_table.vibrations',
+            lambda self, vibrations: {
+                'rows': len(vibrations.get('frequencies', []))})
     def _md_table(self, vibrations):
         import math
         table = '''### Normal Modes
@@ -204,6 +208,18 @@ class Orbitals(Visualization):
         self._provider.load_orbital(mo)
         return super(Orbitals, self).show(viewer=viewer, volume=volume, isosurface=isosurface, menu=menu, mo=mo, iso=iso, transfer_function=transfer_function)
 
+    def load(self, mos):
+        """
+        Compute several molecular orbitals in one pass, so that they can
+        then be shown without being recomputed.
+
+        Parameters
+        ----------
+        mos : list
+            The orbitals to load, indices or 'homo' / 'lumo'.
+        """
+        self._provider.load_orbitals(mos)
+
     def data(self):
         whitelist = ['orbitals', 'properties']
         output = {}
@@ -228,6 +244,8 @@ class Properties(Visualization):
     def data(self):
         return self._provider.cjson.get('properties', {})
 
+    @traced('md_table.properties',
+            lambda self, properties: {'rows': len(properties)})
     def _md_table(self, properties):
         import math
         table = '''### Calculated Properties
@@ -266,6 +284,8 @@ class Geometries(Visualization):
     def data(self):
         return self._provider.geometries
 
+    @traced('md_table.geometries',
+            lambda self, geometries: {'rows': len(geometries)})
     def _md_table(self, geometries):
         import math
         table = '''### Geometries
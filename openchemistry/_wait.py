@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+from ._calculation import AttributeInterceptor, CalculationResult, _map_ordered
+from ._girder import GirderClient
+from ._status import FINAL_STATUSES, TaskflowStatusCache
+
+# Seconds between the first polls, multiplied by BACKOFF after every poll
+# where nothing completed, up to MAX_INTERVAL
+DEFAULT_INTERVAL = 1
+MAX_INTERVAL = 30
+BACKOFF = 1.5
+
+class _Waiter(object):
+    """Tracks the taskflows of a set of results, shared by the sync and async
+    helpers."""
+
+    def __init__(self, results, interval, max_interval):
+        self.results = list(results)
+        self.done = {}
+        self.pending = {}
+        self.interval = interval
+        self.max_interval = max_interval
+
+        for i, result in enumerate(self.results):
+            result = _unwrap(result)
+            taskflow_id = _pending_taskflow_id(result)
+            if taskflow_id is None:
+                self.done[i] = result
+            else:
+                self.pending[i] = (result, taskflow_id)
+                TaskflowStatusCache().register(taskflow_id)
+
+    def poll(self):
+        """Refresh all the pending taskflows at once, returns the indices of
+        the results that completed."""
+        if not self.pending:
+            return []
+
+        cache = TaskflowStatusCache()
+        cache.refresh(set(x[1] for x in self.pending.values()))
+
+        completed = [i for i, (_, taskflow_id) in self.pending.items()
+                     if cache.cached(taskflow_id) in FINAL_STATUSES]
+        pending = [self.pending.pop(i) for i in completed]
+
+        # The results of a taskflow complete together, fetch them through the
+        # bounded pool rather than one after the other
+        def refresh(item):
+            result, taskflow_id = item
+            return _refreshed(result, cache.cached(taskflow_id))
+
+        for i, result in zip(completed, _map_ordered(refresh, pending)):
+            self.done[i] = result
+
+        if completed:
+            self.interval = DEFAULT_INTERVAL
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+
+        return completed
+
+def _unwrap(result):
+    if isinstance(result, AttributeInterceptor):
+        return result.unwrap()
+
+    return result
+
+def _pending_taskflow_id(result):
+    properties = getattr(result, '_properties', None)
+    if not isinstance(properties, dict) or not properties.get('pending'):
+        return None
+
+    return properties.get('taskFlowId')
+
+def _refreshed(result, status):
+    """
+    A new result, with the properties of the completed calculation. When
+    the taskflow ended in error before recording the error of the
+    calculation, it is set from the status of the taskflow.
+    """
+    calculation = GirderClient().get('calculations/%s' % result._id)
+    properties = calculation.get('properties')
+
+    if (status != 'complete' and isinstance(properties, dict) and
+            properties.get('pending') and not properties.get('error')):
+        properties = dict(properties, pending=False,
+                          error='The taskflow ended with status: %s' % status)
+
+    return CalculationResult(calculation['_id'], properties,
+                             result._molecule_id)
+
+def _deadline(timeout):
+    return None if timeout is None else time.monotonic() + timeout
+
+def _sleep_time(waiter, deadline):
+    if deadline is None:
+        return waiter.interval
+
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError('%s calculations are still pending' %
+                           len(waiter.pending))
+
+    return min(waiter.interval, remaining)
+
+def as_completed(results, timeout=None, interval=DEFAULT_INTERVAL,
+                 max_interval=MAX_INTERVAL):
+    """Iterate over calculation results as they complete
+
+    The taskflows of all the pending results are polled together, backing
+    off while nothing completes. The results of the same taskflow complete
+    together. Failed calculations are yielded too, with their error in
+    result.error (None for the calculations that succeeded).
+
+    Parameters
+    ----------
+    results : list
+        Calculation results, as returned by run_calculations or calculate.
+    timeout : float
+        The maximum number of seconds to wait, a TimeoutError is raised
+        when it expires. Waits forever by default.
+    interval : float
+        The initial number of seconds between the polls.
+    max_interval : float
+        The maximum number of seconds between the polls.
+
+    Yields
+    ------
+    result : CalculationResult
+        The completed or failed results, no longer wrapped, in order of
+        completion.
+    """
+    waiter = _Waiter(results, interval, max_interval)
+    deadline = _deadline(timeout)
+
+    for result in list(waiter.done.values()):
+        yield result
+
+    while waiter.pending:
+        for i in waiter.poll():
+            yield waiter.done[i]
+
+        if waiter.pending:
+            time.sleep(_sleep_time(waiter, deadline))
+
+def wait(results, timeout=None, interval=DEFAULT_INTERVAL,
+         max_interval=MAX_INTERVAL):
+    """Block until all the calculation results are complete
+
+    See as_completed for the parameters.
+
+    Returns
+    -------
+    results : list
+        The completed or failed results, no longer wrapped, in the same
+        order. Check result.error to tell them apart.
+    """
+    results = list(results)
+    completed = {}
+    for result in as_completed(results, timeout, interval, max_interval):
+        completed[result._id] = result
+
+    return [completed[_unwrap(x)._id] for x in results]
+
+async def as_completed_async(results, timeout=None, interval=DEFAULT_INTERVAL,
+                             max_interval=MAX_INTERVAL):
+    """Asynchronous version of as_completed, the requests are made in the
+    default executor."""
+    loop = asyncio.get_event_loop()
+    waiter = await loop.run_in_executor(None, _Waiter, results, interval,
+                                        max_interval)
+    deadline = _deadline(timeout)
+
+    for result in list(waiter.done.values()):
+        yield result
+
+    while waiter.pending:
+        for i in await loop.run_in_executor(None, waiter.poll):
+            yield waiter.done[i]
+
+        if waiter.pending:
+            await asyncio.sleep(_sleep_time(waiter, deadline))
+
+async def wait_async(results, timeout=None, interval=DEFAULT_INTERVAL,
+                     max_interval=MAX_INTERVAL):
+    """Asynchronous version of wait."""
+    results = list(results)
+    completed = {}
+    async for result in as_completed_async(results, timeout, interval,
+                                           max_interval):
+        completed[result._id] = result
+
+    return [completed[_unwrap(x)._id] for x in results]
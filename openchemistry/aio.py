@@ -0,0 +1,103 @@
+"""Asynchronous versions of the openchemistry functions
+
+The functions of openchemistry.api are run in a bounded pool of worker
+threads sharing the pooled connections of the Girder client, so that many
+lookups and submissions can be fanned out from a notebook or a service:
+
+    import asyncio
+    from openchemistry import aio
+
+    molecules = await asyncio.gather(
+        *[aio.find_molecule(x) for x in identifiers])
+
+At most `concurrency` requests are in flight at once, see set_concurrency.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import api
+from ._girder import GirderClient
+from ._wait import as_completed_async as as_completed
+from ._wait import wait_async as wait
+
+DEFAULT_CONCURRENCY = 16
+
+_lock = threading.Lock()
+_executor = None
+_concurrency = DEFAULT_CONCURRENCY
+
+def set_concurrency(limit):
+    """
+    Set the maximum number of concurrent operations, the connection pool of
+    the Girder client is resized to match.
+    """
+    global _executor, _concurrency
+
+    with _lock:
+        _concurrency = limit
+        executor, _executor = _executor, None
+
+    if executor is not None:
+        # Let the running operations finish
+        executor.shutdown(wait=False)
+
+    GirderClient().set_pool_size(max(limit, GirderClient().pool_size))
+
+def get_concurrency():
+    return _concurrency
+
+def _get_executor():
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(_concurrency,
+                                           thread_name_prefix='oc-aio')
+        return _executor
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(func, *args, **kwargs))
+
+def _async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await _run(func, *args, **kwargs)
+
+    wrapper.__doc__ = 'Asynchronous version of openchemistry.%s\n\n%s' % (
+        func.__name__, func.__doc__ or '')
+
+    return wrapper
+
+find_structure = _async(api.find_structure)
+find_molecule = _async(api.find_molecule)
+find_calculation = _async(api.find_calculation)
+import_structure = _async(api.import_structure)
+run_calculations = _async(api.run_calculations)
+find_spectra = _async(api.find_spectra)
+
+async def gather(*aws, limit=None):
+    """
+    Like asyncio.gather, but with at most limit awaitables running at once.
+    Useful to bound the number of pending operations, on top of the limit on
+    concurrent requests.
+    """
+    if limit is None:
+        return await asyncio.gather(*aws)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[bounded(aw) for aw in aws])
+
+__all__ = [
+    'find_structure', 'find_molecule', 'find_calculation', 'import_structure',
+    'run_calculations', 'find_spectra', 'wait', 'as_completed', 'gather',
+    'set_concurrency', 'get_concurrency'
+]
@@ -1,7 +1,5 @@
-from jinja2 import Environment, BaseLoader
 from girder_client import HttpError
 import re
-import avogadro
 
 from ._girder import GirderClient
 from ._molecule import Molecule
@@ -126,7 +124,7 @@ def find_calculation(molecule, image_name=None, input_parameters=None, input_geo
     calculation = _fetch_calculation(molecule._id, image_name, input_parameters, input_geometry)
     if calculation is None:
         raise Exception('Unable to find a matching calculation in the database')
-    return CalculationResult(calculation['_id'])
+    return CalculationResult(calculation['_id'], calculation.get('properties'))
 
 def find_structure(identifier=None, image_name=None, input_parameters=None, input_geometry=None, inchi=None, smiles=None):
     molecule = find_molecule(identifier, inchi, smiles)
@@ -141,6 +139,8 @@ def find_structure(identifier=None, image_name=None, input_parameters=None, inpu
         return molecule
 
 def load(data):
+    import avogadro
+
     if isinstance(data, dict):
         provider = CjsonProvider(data)
     elif isinstance(data, avogadro.core.Molecule):
@@ -224,7 +224,7 @@ def find_spectra(identifier, theo_intensities, stype='IR', source='NIST'):
 
 def run_calculations(girder_molecules, image_name, input_parameters,
                      input_geometries=None, run_parameters=None,
-                     force=False):
+                     force=False, max_workers=None, progress=False):
     """Run multiple calculations in one taskflow
 
     This will search for each calculation to see if it has already been
@@ -246,6 +246,12 @@ def run_calculations(girder_molecules, image_name, input_parameters,
     force : bool
         Force all of the calculations to be performed, even if they
         have already been run once.
+    max_workers : int
+        The maximum number of concurrent requests sent to the server while
+        looking up and submitting the calculations.
+    progress : bool or callable
+        If True print the progress of each stage, if callable it is called
+        with (stage, done, total) as the calculations are processed.
     """
     if (not isinstance(input_parameters, dict) or
             'task' not in input_parameters):
@@ -258,10 +264,15 @@ def run_calculations(girder_molecules, image_name, input_parameters,
     calculations = _fetch_or_submit_calculations(molecule_ids, image_name,
                                                  input_parameters,
                                                  input_geometries,
-                                                 run_parameters, force)
+                                                 run_parameters, force,
+                                                 max_workers, progress)
 
+    # Duplicated requests share the calculation, and its result
     results = []
+    shared = {}
     for c, m in zip(calculations, molecule_ids):
-        results.append(_calculation_result(c, m))
+        if c['_id'] not in shared:
+            shared[c['_id']] = _calculation_result(c, m)
+        results.append(shared[c['_id']])
 
     return results
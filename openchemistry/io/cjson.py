@@ -1,7 +1,9 @@
 import json
 from .base import BaseReader
+from .._tracing import cjson_attributes, traced
 
 # Trivial Cjson reader
 class CjsonReader(BaseReader):
+    @traced('io.CjsonReader.read', result=cjson_attributes)
     def read(self):
         return json.load(self._file)
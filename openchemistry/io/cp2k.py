@@ -2,11 +2,13 @@ import json
 import os
 
 from .base import BaseReader
+from .._tracing import cjson_attributes, traced
 from .constants import EV_TO_J_MOL
 from .utils import _cleanup_cclib_cjson
 
 class Cp2kReader(BaseReader):
 
+    @traced('io.Cp2kReader.read', result=cjson_attributes)
     def read(self):
         import cclib
 
@@ -1,13 +1,16 @@
 import json
-from avogadro.core import Molecule
-from avogadro.io import FileFormatManager
-from jsonpath_rw import parse
 from .base import BaseReader
+from .._tracing import cjson_attributes, traced
 from .constants import HARTREE_TO_J_MOL
 
 class NWChemJsonReader(BaseReader):
 
+    @traced('io.NWChemJsonReader.read', result=cjson_attributes)
     def read(self):
+        from avogadro.core import Molecule
+        from avogadro.io import FileFormatManager
+        from .._utils import jsonpath
+
         str_data = self._file.read()
         mol = Molecule()
         conv = FileFormatManager()
@@ -16,7 +19,7 @@ class NWChemJsonReader(BaseReader):
         cjson = json.loads(cjson_str)
         # Copy some calculated properties
         data = json.loads(str_data)
-        energy = parse('simulation.calculations[0].calculationResults.totalEnergy.value').find(data)
+        energy = jsonpath('simulation.calculations[0].calculationResults.totalEnergy.value').find(data)
         if len(energy) == 1:
             energy = energy[0].value
             cjson.setdefault('properties', {})['totalEnergy'] = energy * HARTREE_TO_J_MOL
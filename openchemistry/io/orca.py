@@ -3,12 +3,14 @@ from .utils import (
     _cclib_to_cjson_vibdisps,
 )
 from .base import BaseReader
+from .._tracing import cjson_attributes, traced
 from .constants import EV_TO_J_MOL
 
 
 class OrcaReader(BaseReader):
     """A class to parse orca output files and dump a chemical json file"""
 
+    @traced('io.OrcaReader.read', result=cjson_attributes)
     def read(self):
         """Read orca output file"""
         import cclib
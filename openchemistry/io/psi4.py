@@ -2,10 +2,12 @@ import json
 
 from .utils import _cclib_to_cjson_basis, _cclib_to_cjson_mocoeffs, _cclib_to_cjson_vibdisps, _cleanup_cclib_cjson
 from .base import BaseReader
+from .._tracing import cjson_attributes, traced
 from .constants import EV_TO_J_MOL
 
 class Psi4Reader(BaseReader):
 
+    @traced('io.Psi4Reader.read', result=cjson_attributes)
     def read(self):
         import cclib
 
@@ -26,6 +26,8 @@ def setup_reaction(equation):
     return Reaction(equation)
 
 def compose_equation(equation, **vars):
+    from jinja2 import Environment, BaseLoader
+
     equation = Environment(loader=BaseLoader()).from_string(equation)
 
     return equation.render(**vars)
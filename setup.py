@@ -38,9 +38,11 @@ setup(
     classifiers=[
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: BSD License',
-        'Programming Language :: Python :: 3.6'
+        'Programming Language :: Python :: 3.7'
     ],
 
+    python_requires='>=3.7',
+
     keywords='',
 
     packages=find_packages(exclude='taskflows'),
@@ -0,0 +1,566 @@
+"""Offline benchmark of the OpenChemistry taskflow pipeline
+
+Drives the tasks of taskflows.openchemistry_taskflow from start to
+postprocess_job for synthetic batches of calculations, without celery,
+cumulus, girder or a cluster. They are replaced by local fakes installed in
+sys.modules before the taskflows are imported:
+
+- the tasks run one after the other in this process, the countdowns are
+  skipped
+- the girder client keeps the documents in memory, delays every call by a
+  configurable latency and counts the calls of each endpoint
+- submit_job, download_job_input_folders, monitor_job and
+  upload_job_output_to_folder act on a fake scheduler, which runs the jobs
+  instantly and writes one output file per calculation
+
+Reports the duration of every stage recorded by utils.timing, and the
+number of girder calls by endpoint.
+
+    python taskflows/benchmarks/bench_taskflow.py --sizes 1 100 1000 10000
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+# The directory containing the taskflows package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CONTAINER_DESCRIPTION = {
+    'name': 'benchmark',
+    'version': '1.0',
+    'input': {'format': 'xyz'},
+    'output': {'format': 'cjson'}
+}
+
+IMAGE = {'repository': 'openchemistry/benchmark', 'tag': 'latest'}
+
+class Bench(object):
+    """The state shared by the fakes during a run."""
+    scheduler = None
+    girder = None
+    taskflow = None
+
+def _object_id(counter):
+    return '%024x' % counter
+
+_id_regex = re.compile('[0-9a-f]{24}')
+
+def _endpoint(method, path):
+    return '%s %s' % (method, _id_regex.sub('{id}', path.strip('/')))
+
+# Celery and the cumulus taskflow machinery
+
+class Signature(object):
+    def __init__(self, task, args, kwargs):
+        self.task = task
+        self.args = args
+        self.kwargs = kwargs
+
+class Task(object):
+    """A celery task, bound tasks receive the current task as first
+    argument."""
+
+    def __init__(self, func, bind=True):
+        self.func = func
+        self.bind = bind
+        self.__name__ = func.__name__
+
+    def __call__(self, *args, **kwargs):
+        if self.bind:
+            return self.func(_TaskContext(), *args, **kwargs)
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        Bench.scheduler.enqueue(self, args, kwargs)
+
+    def s(self, *args, **kwargs):
+        return Signature(self, args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, countdown=0, link=None):
+        Bench.scheduler.enqueue(self, args, kwargs or {}, countdown, link)
+
+class _TaskContext(object):
+    @property
+    def taskflow(self):
+        return Bench.taskflow
+
+class Scheduler(object):
+    """Runs the queued tasks in order, the countdowns are only added up."""
+
+    def __init__(self):
+        self.queue = collections.deque()
+        self.skipped = 0
+        self.tasks = collections.Counter()
+        self.jobs = {}
+
+    def enqueue(self, task, args, kwargs, countdown=0, link=None):
+        self.skipped += countdown or 0
+        self.queue.append((task, args, kwargs, link))
+
+    def run(self):
+        while self.queue:
+            task, args, kwargs, link = self.queue.popleft()
+            self.tasks[task.__name__] += 1
+            result = task(*args, **kwargs)
+            if link is not None:
+                # Like celery, the callback receives the result first
+                self.enqueue(link.task, (result,) + link.args, link.kwargs)
+
+class FakeTaskFlow(object):
+    def __init__(self):
+        self.id = _object_id(1)
+        self.girder_api_url = 'http://localhost/api/v1'
+        self.girder_token = 'benchmark'
+        self.logger = logging.getLogger('bench_taskflow')
+        self.meta = {}
+        self._lock = threading.Lock()
+
+    def set_metadata(self, key, value):
+        with self._lock:
+            self.meta[key] = value
+
+    def get_metadata(self, key):
+        with self._lock:
+            if key not in self.meta:
+                return {}
+            return {key: self.meta[key]}
+
+# Girder
+
+class Response(object):
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    def json(self):
+        return json.loads(self.content)
+
+class FakeGirderClient(object):
+    """An in-memory girder, counting the calls of each endpoint."""
+
+    def __init__(self, latency=0):
+        from girder_client import HttpError
+
+        self._http_error = HttpError
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self._ids = 1000
+        self.calculations = {}
+        self.molecules = {}
+        self.folders = {}
+        self.items = {}
+        self.files = {}
+        self.item_files = collections.defaultdict(list)
+        self.jobs = {}
+        self.images = {}
+
+    def next_id(self):
+        with self._lock:
+            self._ids += 1
+            return _object_id(self._ids)
+
+    def _call(self, method, path):
+        with self._lock:
+            self.calls[_endpoint(method, path)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _not_found(self, method, path):
+        return self._http_error(404, path, method, 'Not found')
+
+    # Documents
+
+    def add_folder(self, parent_id, name):
+        _id = self.next_id()
+        with self._lock:
+            self.folders[_id] = {'_id': _id, 'parentId': parent_id,
+                                 'name': name}
+        return self.folders[_id]
+
+    def add_item(self, folder_id, name, data):
+        item_id = self.next_id()
+        file_id = self.next_id()
+        with self._lock:
+            self.items[item_id] = {'_id': item_id, 'folderId': folder_id,
+                                   'name': name}
+            self.files[file_id] = {'_id': file_id, 'itemId': item_id,
+                                   'name': name, 'size': len(data),
+                                   'data': data}
+            self.item_files[item_id].append(file_id)
+        return self.items[item_id]
+
+    # girder_client.GirderClient
+
+    def get(self, path, parameters=None, jsonResp=True):
+        self._call('GET', path)
+        parts = path.strip('/').split('/')
+
+        if path == 'user/me':
+            return {'_id': _object_id(2), 'login': 'benchmark'}
+        if parts[0] == 'images':
+            images = [x for x in self.images.values()
+                      if x['repository'] == (parameters or {}).get('repository')]
+            return {'results': images}
+        if parts[0] == 'calculations' and len(parts) == 2:
+            return self._get(self.calculations, parts[1], 'GET', path)
+        if parts[0] == 'jobs' and len(parts) == 2:
+            return self._get(self.jobs, parts[1], 'GET', path)
+        if parts[0] == 'molecules':
+            molecule = self._get(self.molecules, parts[1], 'GET', path)
+            return Response(molecule['xyz'].encode())
+
+        raise self._not_found('GET', path)
+
+    def _get(self, collection, _id, method, path):
+        document = collection.get(_id)
+        if document is None:
+            raise self._not_found(method, path)
+
+        return document
+
+    def post(self, path, parameters=None, data=None, json=None):
+        self._call('POST', path)
+        if path == 'jobs':
+            body = _decode(data)
+            _id = self.next_id()
+            job = dict(body, _id=_id, status='created')
+            with self._lock:
+                self.jobs[_id] = job
+            return job
+
+        raise self._not_found('POST', path)
+
+    def put(self, path, parameters=None, data=None, json=None):
+        self._call('PUT', path)
+        parts = path.strip('/').split('/')
+        if parts[0] == 'calculations':
+            calculation = self._get(self.calculations, parts[1], 'PUT', path)
+            if len(parts) == 3 and parts[2] == 'properties':
+                calculation['properties'] = json
+            else:
+                # Ingest the output
+                calculation['properties'] = {'pending': False}
+                calculation['fileId'] = json['fileId']
+            return calculation
+
+        raise self._not_found('PUT', path)
+
+    def patch(self, path, parameters=None, data=None, json=None):
+        self._call('PATCH', path)
+        parts = path.strip('/').split('/')
+        if parts[0] == 'images':
+            image = self._get(self.images, parts[1], 'PATCH', path)
+            image.update(json)
+            return image
+
+        raise self._not_found('PATCH', path)
+
+    def delete(self, path, parameters=None):
+        self._call('DELETE', path)
+        parts = path.strip('/').split('/')
+        if parts[0] == 'folder':
+            with self._lock:
+                self.folders.pop(parts[1], None)
+            return
+
+        raise self._not_found('DELETE', path)
+
+    def createFolder(self, parentId, name, description='',
+                     parentType='folder', public=None, reuseExisting=False,
+                     metadata=None):
+        self._call('POST', 'folder')
+        return self.add_folder(parentId, name)
+
+    def uploadFile(self, parentId, stream, name, size, parentType='item',
+                   progressCallback=None, reference=None, mimeType=None):
+        # An upload is initialized, then sent in a single chunk
+        self._call('POST', 'file')
+        self._call('POST', 'file/chunk')
+        self.add_item(parentId, name, stream.read())
+
+    def listItem(self, folderId, text=None, name=None, limit=None,
+                 offset=None):
+        self._call('GET', 'item')
+        with self._lock:
+            items = [x for x in self.items.values()
+                     if x['folderId'] == folderId]
+        return iter(items)
+
+    def listFile(self, itemId, limit=None, offset=None):
+        self._call('GET', 'item/%s/files' % itemId)
+        with self._lock:
+            files = [dict(self.files[x]) for x in self.item_files[itemId]]
+        for f in files:
+            del f['data']
+        return iter(files)
+
+    def downloadFile(self, fileId, path, created=None):
+        self._call('GET', 'file/%s/download' % fileId)
+        path.write(self.files[fileId]['data'])
+
+    def resourceLookup(self, path):
+        self._call('GET', 'resource/lookup')
+        return {'_id': self.next_id(), 'name': path.split('/')[-1]}
+
+    @contextlib.contextmanager
+    def session(self):
+        yield types.SimpleNamespace(cookies=types.SimpleNamespace(
+            set=lambda *args: None))
+
+def _decode(data):
+    return json.loads(data)
+
+def create_girder_client(girder_api_url, girder_token):
+    return Bench.girder
+
+# cumulus.tasks.job and the scheduler
+
+_output_regex = re.compile(r' -o (\S+)')
+
+def download_job_input_folders(cluster, job, girder_token=None, submit=True):
+    Bench.scheduler.tasks['download_job_input_folders'] += 1
+
+def submit_job(cluster, job, girder_token=None, monitor=True):
+    Bench.scheduler.tasks['submit_job'] += 1
+    # Queued for one poll of the scheduler, then running for another one
+    Bench.scheduler.jobs[job['_id']] = ['queued', 'running']
+
+def _monitor_job(cluster, job, girder_token=None, monitor_interval=5):
+    job = Bench.girder.jobs[job['_id']]
+    job['status'] = 'complete'
+
+def upload_job_output_to_folder(cluster, job, girder_token=None):
+    """Write the output file of every calculation of the job."""
+    Bench.scheduler.tasks['upload_job_output_to_folder'] += 1
+    output_folder = job['output'][0]['folderId']
+    outputs = []
+    for command in job['commands']:
+        outputs.extend(_output_regex.findall(command))
+
+    for i, path in enumerate(outputs):
+        if Bench.failed(i):
+            continue
+        Bench.girder.add_item(output_folder, os.path.basename(path),
+                              b'{"chemicalJson": 1}')
+
+class _QueueAdapter(object):
+    def job_statuses(self, jobs):
+        statuses = []
+        for job in jobs:
+            states = Bench.scheduler.jobs.get(job['_id'])
+            if states:
+                statuses.append((job, states.pop(0)))
+        return statuses
+
+@contextlib.contextmanager
+def get_connection(girder_token, cluster):
+    yield None
+
+def get_queue_adapter(cluster, conn):
+    return _QueueAdapter()
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+
+    return module
+
+def install_fakes():
+    """Install the fake celery, cumulus and girder modules."""
+    cumulus = _module('cumulus')
+    cumulus.taskflow = _module('cumulus.taskflow', task=Task,
+                               TaskFlow=object, logging=logging)
+    cumulus.taskflow.cluster = _module(
+        'cumulus.taskflow.cluster', create_girder_client=create_girder_client)
+    cumulus.tasks = _module('cumulus.tasks')
+    cumulus.tasks.job = _module(
+        'cumulus.tasks.job',
+        download_job_input_folders=download_job_input_folders,
+        upload_job_output_to_folder=upload_job_output_to_folder,
+        submit_job=submit_job,
+        monitor_job=Task(_monitor_job, bind=False))
+    cumulus.queue = _module('cumulus.queue',
+                            get_queue_adapter=get_queue_adapter)
+    cumulus.transport = _module('cumulus.transport',
+                                get_connection=get_connection)
+
+    _module('celery', signature=lambda x: x)
+
+    girder = _module('girder')
+    girder.api = _module('girder.api')
+    girder.api.rest = _module('girder.api.rest',
+                              getCurrentUser=lambda: {'login': 'benchmark'})
+    girder.constants = _module(
+        'girder.constants',
+        AccessType=types.SimpleNamespace(READ=0, WRITE=1, ADMIN=2))
+    girder.utility = _module('girder.utility')
+    girder.utility.model_importer = _module(
+        'girder.utility.model_importer', ModelImporter=object)
+
+    if importlib.util.find_spec('avogadro') is None:
+        # Only used to convert cjson to xyz, which the benchmark doesn't do
+        avogadro = _module('avogadro')
+        avogadro.core = _module('avogadro.core', Molecule=object)
+        avogadro.io = _module('avogadro.io', FileFormatManager=object)
+
+def _xyz(atom_count):
+    lines = [str(atom_count), '']
+    for i in range(atom_count):
+        lines.append('C %.3f 0.000 0.000' % (1.5 * i))
+
+    return '\n'.join(lines) + '\n'
+
+def setup(count, parameter_sets, latency, failure_rate):
+    """A fake girder holding count pending calculations."""
+    client = FakeGirderClient(latency)
+    image_id = client.next_id()
+    client.images[image_id] = dict(IMAGE, _id=image_id,
+                                   digest='sha256:benchmark', docker={},
+                                   description=CONTAINER_DESCRIPTION)
+
+    calculation_ids = []
+    for i in range(count):
+        molecule_id = client.next_id()
+        client.molecules[molecule_id] = {
+            '_id': molecule_id,
+            # Between 2 and 30 atoms
+            'xyz': _xyz(2 + i % 29)
+        }
+        calculation_id = client.next_id()
+        client.calculations[calculation_id] = {
+            '_id': calculation_id,
+            'moleculeId': molecule_id,
+            'input': {
+                'parameters': {
+                    'task': 'energy',
+                    'theory': 'dft',
+                    'basis': 'basis-%s' % (i % parameter_sets)
+                }
+            },
+            'properties': {'pending': True}
+        }
+        calculation_ids.append(calculation_id)
+
+    Bench.girder = client
+    Bench.scheduler = Scheduler()
+    Bench.taskflow = FakeTaskFlow()
+    # Spread the failures evenly
+    step = int(1 / failure_rate) if failure_rate else 0
+    Bench.failed = staticmethod(lambda i: step and i % step == step - 1)
+
+    return calculation_ids
+
+def run(count, run_parameters, parameter_sets=1, latency=0, failure_rate=0):
+    from taskflows.openchemistry_taskflow import start
+
+    calculation_ids = setup(count, parameter_sets, latency, failure_rate)
+    cluster = {'_id': _object_id(3), 'name': 'benchmark', 'config': {}}
+    user = {'login': 'benchmark'}
+
+    start_time = time.perf_counter()
+    start.delay({'calculations': calculation_ids}, user, cluster,
+                dict(IMAGE), run_parameters)
+    error = None
+    try:
+        Bench.scheduler.run()
+    except Exception as ex:
+        error = ex
+    elapsed = time.perf_counter() - start_time
+
+    ingested = sum(1 for x in Bench.girder.calculations.values()
+                   if 'fileId' in x)
+
+    return elapsed, ingested, error
+
+def stages(meta):
+    """The total duration of each stage, in order of first start."""
+    totals = {}
+    for key, value in meta.items():
+        if not key.startswith('stage_') or not isinstance(value, dict):
+            continue
+        total = totals.setdefault(value['stage'], [value['start'], 0, 0])
+        total[0] = min(total[0], value['start'])
+        total[1] += value['duration']
+        total[2] += 1
+
+    return sorted(totals.items(), key=lambda x: x[1][0])
+
+def report(count, elapsed, ingested, error, verbose):
+    from taskflows.utils.timing import monitor_polls
+
+    meta = Bench.taskflow.meta
+    jobs = meta.get('jobs') or []
+    calls = Bench.girder.calls
+    polls = monitor_polls({'meta': meta})
+
+    print('%d calculations, %d jobs: %.3f s, %d ingested, %d girder calls, '
+          '%d scheduler polls' % (count, len(jobs), elapsed, ingested,
+                                  sum(calls.values()), polls))
+    if error is not None:
+        print('  failed: %r' % error)
+
+    print('  %-28s %6s %10s' % ('stage', 'count', 'time (s)'))
+    for stage, (_, duration, n) in stages(meta):
+        print('  %-28s %6d %10.3f' % (stage, n, duration))
+
+    if verbose:
+        print('  %-40s %8s' % ('girder endpoint', 'calls'))
+        for endpoint, n in calls.most_common():
+            print('  %-40s %8d' % (endpoint, n))
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the taskflow pipeline with local fakes.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1, 100, 1000, 10000],
+                        help='the number of calculations of the batches')
+    parser.add_argument('--latency', type=float, default=1,
+                        help='the latency of every girder call, in '
+                             'milliseconds')
+    parser.add_argument('--chunk-size', type=int,
+                        help='the chunkSize run parameter')
+    parser.add_argument('--max-jobs', type=int,
+                        help='the maxJobs run parameter')
+    parser.add_argument('--parameter-sets', type=int, default=1,
+                        help='the number of distinct input parameters')
+    parser.add_argument('--no-archive', action='store_true',
+                        help='upload the input files one by one')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='the fraction of calculations without output')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print the girder calls by endpoint')
+
+    args = parser.parse_args()
+
+    install_fakes()
+    # The errors of the failed calculations are expected
+    logging.basicConfig(level=logging.ERROR if args.verbose
+                        else logging.CRITICAL)
+
+    run_parameters = {'archiveInput': not args.no_archive}
+    if args.chunk_size:
+        run_parameters['chunkSize'] = args.chunk_size
+    if args.max_jobs:
+        run_parameters['maxJobs'] = args.max_jobs
+
+    for count in args.sizes:
+        elapsed, ingested, error = run(count, dict(run_parameters),
+                                       args.parameter_sets,
+                                       args.latency / 1000,
+                                       args.failure_rate)
+        report(count, elapsed, ingested, error, args.verbose)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Report the stage timings of taskflows per image and per cluster
+
+Aggregates the stages recorded by taskflows.utils.timing in the metadata of
+finished taskflows, fetched from Girder or read from a JSON file:
+
+    python taskflows/scripts/stage_timings.py --api-url <girder api url> \
+        --api-key <key> <taskflow id> [<taskflow id> ...]
+    python taskflows/scripts/stage_timings.py --file taskflows.json
+
+Importing the taskflows package needs cumulus, celery and girder, which are
+only installed on the workers. timing.py is loaded from its file instead.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+
+# The directory containing the taskflows package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMING = os.path.join(ROOT, 'taskflows', 'utils', 'timing.py')
+
+
+def _load_timing():
+    spec = importlib.util.spec_from_file_location('timing', TIMING)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+timing = _load_timing()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report the stage timings of taskflows per image and '
+                    'per cluster.')
+    parser.add_argument('taskflows', nargs='*',
+                        help='the ids of the taskflows to fetch')
+    parser.add_argument('--api-url', help='the girder api url')
+    parser.add_argument('--api-key', help='a girder api key')
+    parser.add_argument('--file',
+                        help='a JSON file containing a list of taskflow '
+                             'documents, instead of fetching them')
+    parser.add_argument('--percentiles', type=float, nargs='+',
+                        default=[50, 90, 99])
+
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            taskflows = json.load(f)
+    else:
+        if not args.api_url:
+            parser.error('--api-url is required to fetch the taskflows')
+
+        import girder_client
+        client = girder_client.GirderClient(apiUrl=args.api_url)
+        if args.api_key:
+            client.authenticate(apiKey=args.api_key)
+        taskflows = [client.get('taskflows/%s' % x) for x in args.taskflows]
+
+    percentiles = [int(q) if q == int(q) else q for q in args.percentiles]
+    report = timing.aggregate_timings(taskflows, percentiles)
+    print(timing.format_report(report, percentiles))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
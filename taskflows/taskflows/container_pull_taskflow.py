@@ -2,7 +2,7 @@ import cumulus
 from cumulus.taskflow import TaskFlow
 from cumulus.taskflow import logging
 from cumulus.taskflow.cluster import create_girder_client
-from cumulus.tasks.job import monitor_job, submit_job
+from cumulus.tasks.job import submit_job
 from cumulus.tasks.job import (
     download_job_input_folders, upload_job_output_to_folder
 )
@@ -12,9 +12,10 @@ from girder.api.rest import getCurrentUser
 from girder.constants import AccessType
 from girder.utility.model_importer import ModelImporter
 
+from .monitor import monitor_job_adaptively
 from .utils import (
     get_cori, get_oc_folder, log_and_raise, is_demo, is_nersc, countdown,
-    post_image_to_database
+    post_image_to_database, get_monitor_policy
 )
 
 import datetime
@@ -185,11 +186,10 @@ def start(task, user, cluster, image, container):
     submit_job(cluster, job, girder_token=task.taskflow.girder_token,
                monitor=False)
 
-    monitor_job.apply_async(
-        (cluster, job), {'girder_token': task.taskflow.girder_token,
-                         'monitor_interval': 10},
-        countdown=countdown(cluster),
-        link=postprocess_job.s(user, cluster, image, job, folder, container))
+    monitor_job_adaptively(
+        cluster, job, get_monitor_policy(cluster),
+        postprocess_job.s(user, cluster, image, job, folder, container),
+        countdown=countdown(cluster))
 
 
 @cumulus.taskflow.task
@@ -0,0 +1,115 @@
+import time
+
+import cumulus
+from celery import signature
+from cumulus.queue import get_queue_adapter
+from cumulus.tasks.job import monitor_job
+from cumulus.transport import get_connection
+
+from .utils import count_monitor_poll, monitor_interval
+from .utils.timing import record_stage
+
+# The scheduler states of a job that is still waiting to run
+QUEUED_STATES = ['queued', 'held']
+
+
+def _queue_states(cluster, jobs, girder_token):
+    """
+    Returns the scheduler state of each job, with a single query. The state
+    is None for the jobs no longer known to the scheduler.
+    """
+    with get_connection(girder_token, cluster) as conn:
+        adapter = get_queue_adapter(cluster, conn)
+        statuses = adapter.job_statuses(jobs)
+
+    states = {job['_id']: state for job, state in statuses}
+
+    return [states.get(job['_id']) for job in jobs]
+
+
+def monitor_job_adaptively(cluster, job, policy, link, countdown=0):
+    """
+    Monitor a job following a monitoring policy (see
+    utils.get_monitor_policy), link is run once the job has completed.
+    """
+    monitor_jobs_adaptively(cluster, [job], policy, [link], countdown)
+
+
+def monitor_jobs_adaptively(cluster, jobs, policy, links, countdown=0):
+    """
+    Monitor several jobs on the same cluster with a single scheduler query
+    per poll, links[i] is run once jobs[i] has completed.
+    """
+    now = time.time()
+    monitors = [{'job': job, 'link': link, 'submittedAt': now}
+                for job, link in zip(jobs, links)]
+    # Identifies the chain of monitoring tasks, to count its polls
+    chain_id = jobs[0]['_id']
+
+    adaptive_monitor_jobs.apply_async((cluster, policy, monitors, chain_id),
+                                      countdown=countdown)
+
+
+@cumulus.taskflow.task
+def adaptive_monitor_jobs(task, cluster, policy, monitors, chain_id=None):
+    if chain_id is None:
+        chain_id = monitors[0]['job']['_id']
+
+    girder_token = task.taskflow.girder_token
+    jobs = [monitor['job'] for monitor in monitors]
+
+    try:
+        states = _queue_states(cluster, jobs, girder_token)
+    except Exception:
+        task.taskflow.logger.exception(
+            'Unable to query the state of the jobs, falling back to regular '
+            'monitoring.')
+        states = [None] * len(jobs)
+
+    count_monitor_poll(task, chain_id)
+
+    now = time.time()
+    active = []
+    intervals = []
+    for monitor, new_state in zip(monitors, states):
+        job = monitor['job']
+        running_since = monitor.get('runningSince')
+
+        if new_state in QUEUED_STATES:
+            new_state = 'queued'
+        elif new_state == 'running':
+            if running_since is None:
+                running_since = monitor['runningSince'] = now
+                if monitor.get('submittedAt') is not None:
+                    record_stage(task, 'queue', monitor['submittedAt'],
+                                 running_since, 'queue_%s' % job['_id'])
+        else:
+            if running_since is not None:
+                # Only accurate to the polling interval
+                record_stage(task, 'run', running_since, now,
+                             'run_%s' % job['_id'])
+
+            # The job is done (or in an unexpected state), let cumulus update
+            # its status and trigger the rest of the taskflow
+            monitor_job.apply_async((cluster, job), {
+                'girder_token': girder_token,
+                'monitor_interval': policy['finalInterval']
+            }, link=signature(monitor['link']))
+            continue
+
+        if new_state != monitor.get('state'):
+            monitor['attempt'] = 0
+        monitor['state'] = new_state
+
+        running_for = now - running_since if running_since else 0
+        intervals.append(monitor_interval(policy, new_state,
+                                          monitor['attempt'], running_for))
+        monitor['attempt'] += 1
+        active.append(monitor)
+
+    if not active:
+        return
+
+    # Poll as soon as one of the jobs needs it
+    adaptive_monitor_jobs.apply_async((cluster, policy, active, chain_id),
+                                      countdown=min(intervals))
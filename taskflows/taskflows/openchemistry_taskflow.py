@@ -4,26 +4,48 @@ from cumulus.taskflow import logging
 from cumulus.taskflow.cluster import create_girder_client
 from cumulus.tasks.job import (download_job_input_folders,
                                upload_job_output_to_folder)
-from cumulus.tasks.job import submit_job, monitor_job
+from cumulus.tasks.job import submit_job
 
 from girder.api.rest import getCurrentUser
 from girder.constants import AccessType
 from girder.utility.model_importer import ModelImporter
+from girder_client import HttpError
 
+from .monitor import monitor_job_adaptively, monitor_jobs_adaptively
 from .utils import (
     digest_to_sif, get_cori, get_oc_folder, log_and_raise, log_std_err,
-    is_demo, is_nersc, countdown
+    is_demo, is_nersc, countdown, save_image_description, get_monitor_policy
 )
+from .utils.resources import (
+    count_atoms, estimate_resources, load_samples, record_sample, workload
+)
+from .utils.timing import record_stage, stage_timer, timed_stage
 
+from concurrent.futures import ThreadPoolExecutor
 from jsonpath_rw import parse
 import os
 import datetime
+import hashlib
+import io
+import itertools
 import json
+import math
+import tarfile
 import tempfile
+import time
 import re
 
 STATUS_LEVEL = logging.INFO + 5
 
+# The number of concurrent requests used to stage the input files
+STAGING_WORKERS = 8
+
+# The name of the archive holding the input files of a job
+INPUT_ARCHIVE = 'input.tar.gz'
+
+# The number of outputs ingested concurrently
+INGEST_WORKERS = 8
+
 class OpenChemistryTaskFlow(TaskFlow):
     """
     {
@@ -43,7 +65,16 @@ class OpenChemistryTaskFlow(TaskFlow):
         },
         "runParameters": {
             'container': <the container technology to be used: docker | singularity | shifter>,
-            'keepScratch': <whether to save the raw output of the calculations: default False>
+            'keepScratch': <whether to save the raw output of the calculations: default False>,
+            'chunkSize': <the maximum number of calculations per cluster job: default all of them>,
+            'maxJobs': <the maximum number of cluster jobs the calculations are split into, evenly when chunkSize is not set: default no limit>,
+            'archiveInput': <whether to upload the input files as a single archive: default True>,
+            'monitor': <overrides of the job monitoring policy, see utils.DEFAULT_MONITOR_POLICY>,
+            'queue': <the queue to submit the jobs to: default estimated from past jobs>,
+            'numberOfNodes': <the number of nodes of each job: default estimated from past jobs>,
+            'maxNodes': <the maximum number of nodes the estimate can request: default 1>,
+            'walltime': <the walltime of each job in seconds: default estimated from past jobs>,
+            'constraint': <the node constraint of each job>
         }
     }
     """
@@ -79,10 +110,12 @@ class OpenChemistryTaskFlow(TaskFlow):
             *args, **kwargs)
 
 @cumulus.taskflow.task
+@timed_stage('start')
 def start(task, input_, user, cluster, image, run_parameters):
     """
     The flow is the following:
-    - Dry run the container with the -d flag to obtain a description of the input/output formats
+    - Dry run the container with the -d flag to obtain a description of the input/output formats,
+      unless it has already been stored on the image record for this digest
     - Convert the cjson input geometry to conform to the container's expected format
     - Run the container
     - Convert the container output format into cjson
@@ -97,9 +130,26 @@ def start(task, input_, user, cluster, image, run_parameters):
     if '_id' not in cluster:
         log_and_raise(task, 'Invalid cluster configurations: %s' % cluster)
 
+    # Resolve the digest once, so the following steps don't need to look it up
+    params = _get_job_parameters(task, cluster, image, run_parameters)
+    image = dict(image, digest=params['digest'])
+    task.taskflow.set_metadata('image', image)
+    image_record = _ensure_image_on_server(task, params['repository'],
+                                           params['tag'], params['digest'],
+                                           params['container'])
+
     oc_folder = get_oc_folder(client)
     root_folder = client.createFolder(oc_folder['_id'],
                                     datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%f"))
+
+    # The description only depends on the image digest, reuse it if we have it
+    container_description = image_record.get('description')
+    if container_description is not None:
+        task.taskflow.logger.info('Using the stored container description.')
+        _set_code_metadata(task, container_description)
+        setup_input.delay(input_, cluster, image, run_parameters, root_folder, container_description)
+        return
+
     # temporary folder to save the container in/out description
     description_folder = client.createFolder(root_folder['_id'],
                                     'description')
@@ -113,10 +163,9 @@ def start(task, input_, user, cluster, image, run_parameters):
 
     submit_job(cluster, job, girder_token=task.taskflow.girder_token, monitor=False)
 
-    monitor_job.apply_async((cluster, job), {'girder_token': task.taskflow.girder_token,
-                                             'monitor_interval': 10},
-                                             countdown=countdown(cluster),
-                            link=postprocess_description.s(input_, user, cluster, image, run_parameters, root_folder, job, description_folder))
+    monitor_job_adaptively(cluster, job, get_monitor_policy(cluster),
+                           postprocess_description.s(input_, user, cluster, image, run_parameters, root_folder, job, description_folder, image_record),
+                           countdown=countdown(cluster))
 
 def _get_job_parameters(task, cluster, image, run_parameters):
     container = run_parameters.get('container', 'docker') # docker | singularity
@@ -176,9 +225,6 @@ def _create_description_job(task, cluster, description_folder, image, run_parame
     digest = params['digest']
     job_parameters = params['jobParameters'];
 
-    # Make sure the image exists on the server before we go further
-    _ensure_image_on_server(task, repository, tag, digest, container)
-
     output_file = 'description.json'
 
     run_command = '%s run $IMAGE_NAME' % container
@@ -223,7 +269,8 @@ def _create_description_job(task, cluster, description_folder, image, run_parame
     return job
 
 @cumulus.taskflow.task
-def postprocess_description(task, _, input_, user, cluster, image, run_parameters, root_folder, description_job, description_folder):
+@timed_stage('postprocess_description')
+def postprocess_description(task, _, input_, user, cluster, image, run_parameters, root_folder, description_job, description_folder, image_record):
     task.taskflow.logger.info('Processing the output of the container description job.')
 
     client = create_girder_client(
@@ -262,6 +309,17 @@ def postprocess_description(task, _, input_, user, cluster, image, run_parameter
             tf.seek(0)
             container_description = json.loads(tf.read().decode())
 
+    _set_code_metadata(task, container_description)
+
+    # Store the description on the image, so the next taskflows skip this job
+    save_image_description(task, client, image_record, container_description)
+
+    # remove temporary description folder
+    client.delete('folder/%s' % description_folder['_id'])
+
+    setup_input.delay(input_, cluster, image, run_parameters, root_folder, container_description)
+
+def _set_code_metadata(task, container_description):
     # Add code name and version to the taskflow metadata
     code = {
         'name': container_description.get('name'),
@@ -269,12 +327,8 @@ def postprocess_description(task, _, input_, user, cluster, image, run_parameter
     }
     task.taskflow.set_metadata('code', code)
 
-    # remove temporary description folder
-    client.delete('folder/%s' % description_folder['_id'])
-
-    setup_input.delay(input_, cluster, image, run_parameters, root_folder, container_description)
-
 @cumulus.taskflow.task
+@timed_stage('setup_input')
 def setup_input(task, input_, cluster, image, run_parameters, root_folder, container_description):
     task.taskflow.logger.info('Setting up the calculation input files.')
 
@@ -292,28 +346,36 @@ def setup_input(task, input_, cluster, image, run_parameters, root_folder, conta
         log_and_raise(task, 'Unable to extract calculation ids.')
 
     calculation_ids = calculation_ids[0].value
-    calculations = [client.get('calculations/%s' % x) for x in calculation_ids]
+    with stage_timer(task, 'fetch_calculations'), \
+            ThreadPoolExecutor(STAGING_WORKERS) as executor:
+        calculations = list(executor.map(
+            lambda x: client.get('calculations/%s' % x), calculation_ids))
     molecule_ids = [x['moleculeId'] for x in calculations]
     geometry_ids = [x.get('geometryId') for x in calculations]
 
     input_parameters = [x.get('input', {}).get('parameters', {})
                         for x in calculations]
 
-    # For now, we only allow multiple calculations if all of the input
-    # parameters are the same. Raise an error if they differ.
-    if not all(x == input_parameters[0] for x in input_parameters):
-        msg = ('For running multiple calculations, all input parameters must '
-               'currently be identical')
-        log_and_raise(task, msg)
-
-    input_parameters = input_parameters[0]
+    # Calculations with different input parameters are grouped, each group
+    # gets its own parameter file and container invocation. Reorder the
+    # calculations so that the members of a group are contiguous.
+    groups = _group_by_parameters(input_parameters)
+    order = [i for group in groups for i in group]
+    calculation_ids = [calculation_ids[i] for i in order]
+    molecule_ids = [molecule_ids[i] for i in order]
+    geometry_ids = [geometry_ids[i] for i in order]
+    parameter_indices = [k for k, group in enumerate(groups) for _ in group]
+    input_parameters = [input_parameters[group[0]] for group in groups]
+
+    if len(groups) > 1:
+        task.taskflow.logger.info(
+            'Running %s sets of input parameters.' % len(groups))
 
     input_format = container_description['input']['format']
 
     # Fetch the starting geometries
-    geometry_data = []
-    for molecule_id, geometry_id in zip(molecule_ids, geometry_ids):
-
+    def fetch_geometry(ids):
+        molecule_id, geometry_id = ids
         path = 'molecules/%s/' % molecule_id
         if geometry_id:
             # It is preferred to use the geometry if we have it
@@ -327,45 +389,138 @@ def setup_input(task, input_, cluster, image, run_parameters, root_folder, conta
             raise Exception('Failed to get molecule in format: ' + input_format)
 
         if input_format == 'cjson':
-            geometry_data.append(json.dumps(r.json()))
+            return json.dumps(r.json())
         else:
-            geometry_data.append(r.content.decode('utf-8'))
-
-    # The folder where the input geometry and input parameters are
-    input_folder = client.createFolder(root_folder['_id'], 'input')
-    # The folder where the converted output will be at the end of the job
-    output_folder = client.createFolder(root_folder['_id'], 'output')
-    # The folder where the raw input/output files of the specific code are stored
-    scratch_folder = client.createFolder(root_folder['_id'], 'scratch')
-    # The folder where the cluster stdout and stderr is saved
-    run_folder = client.createFolder(root_folder['_id'], 'run')
-
-    # Save the input parameters to file
-    with tempfile.TemporaryFile() as fp:
-        fp.write(json.dumps(input_parameters).encode())
-        # Get the size of the file
-        size = fp.seek(0, 2)
-        fp.seek(0)
-        name = 'input_parameters.json'
-        input_parameters_file = client.uploadFile(input_folder['_id'],  fp,
-                                                  name, size,
-                                                  parentType='folder')
-
-    # Save the input geometries to files
+            return r.content.decode('utf-8')
+
+    with stage_timer(task, 'fetch_geometries'), \
+            ThreadPoolExecutor(STAGING_WORKERS) as executor:
+        geometry_data = list(executor.map(fetch_geometry,
+                                          zip(molecule_ids, geometry_ids)))
+
+    archive_input = run_parameters.get('archiveInput', True)
+
+    # Used to size the jobs
+    atom_counts = [count_atoms(data, input_format) for data in geometry_data]
+    parameter_info = [{
+        'hash': _parameters_hash(parameters),
+        'task': parameters.get('task'),
+        'basis': parameters.get('basis')
+    } for parameters in input_parameters]
+
+    shards = []
+    chunks = _split_calculations(len(calculation_ids), run_parameters)
+    for index, (begin, end) in enumerate(chunks):
+        # Each job gets its own set of folders, so that its output can be
+        # ingested as soon as it finishes
+        parent_folder = root_folder
+        if len(chunks) > 1:
+            parent_folder = client.createFolder(root_folder['_id'],
+                                                'job_%s' % (index + 1))
+
+        shard = _create_shard_folders(client, parent_folder)
+        shard['index'] = index
+        shard['calculations'] = calculation_ids[begin:end]
+        shard['parameters'] = parameter_indices[begin:end]
+        shard['atoms'] = atom_counts[begin:end]
+        groups_used = set(shard['parameters'])
+        shard['parameterInfo'] = (parameter_info[groups_used.pop()]
+                                  if len(groups_used) == 1 else {})
+
+        with stage_timer(task, 'upload_input',
+                         'upload_input_%s' % (index + 1)):
+            _upload_input(client, shard['inputFolder'], input_parameters,
+                          shard['parameters'], geometry_data[begin:end],
+                          input_format, archive_input)
+
+        shards.append(shard)
+
+    submit_calculation.delay(input_, cluster, image, run_parameters, root_folder, container_description, shards)
+
+def _parameters_hash(parameters):
+    """A hash of the input parameters that does not depend on the key order."""
+    canonical = json.dumps(parameters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _group_by_parameters(input_parameters):
+    """
+    Group the indices of identical input parameters, in order of first
+    appearance.
+    """
+    groups = {}
+    for i, parameters in enumerate(input_parameters):
+        groups.setdefault(_parameters_hash(parameters), []).append(i)
+
+    return list(groups.values())
+
+def _parameters_filename(index):
+    return 'input_parameters_%s.json' % (index + 1)
+
+def _split_calculations(count, run_parameters):
+    """
+    Split the calculations into contiguous chunks according to the chunkSize
+    and maxJobs run parameters. Returns a list of (begin, end) ranges.
+    """
+    chunk_size = run_parameters.get('chunkSize')
+    max_jobs = run_parameters.get('maxJobs')
+    if max_jobs:
+        # Larger chunks than chunkSize if needed to stay within maxJobs
+        chunk_size = max(chunk_size or 0, int(math.ceil(count / max_jobs)))
+    chunk_size = max(chunk_size or count, 1)
+
+    return [(begin, min(begin + chunk_size, count))
+            for begin in range(0, count, chunk_size)]
+
+def _create_shard_folders(client, parent_folder):
+    return {
+        # The folder where the input geometry and input parameters are
+        'inputFolder': client.createFolder(parent_folder['_id'], 'input'),
+        # The folder where the converted output will be at the end of the job
+        'outputFolder': client.createFolder(parent_folder['_id'], 'output'),
+        # The folder where the raw input/output files of the specific code are stored
+        'scratchFolder': client.createFolder(parent_folder['_id'], 'scratch'),
+        # The folder where the cluster stdout and stderr is saved
+        'runFolder': client.createFolder(parent_folder['_id'], 'run')
+    }
+
+def _input_files(input_parameters, parameter_indices, geometry_data, input_format):
+    # Only the parameter sets used by this job
+    files = [(_parameters_filename(k), json.dumps(input_parameters[k]).encode())
+             for k in sorted(set(parameter_indices))]
     for i, data in enumerate(geometry_data):
-        with tempfile.TemporaryFile() as fp:
-            fp.write(data.encode())
-            # Get the size of the file
-            size = fp.seek(0, 2)
-            fp.seek(0)
-            name = 'geometry_' + str(i + 1) + '.%s' % input_format
-            input_geometry_file = client.uploadFile(input_folder['_id'], fp,
-                                                    name, size,
-                                                    parentType='folder')
-
-    submit_calculation.delay(input_, cluster, image, run_parameters, root_folder, container_description, input_folder, output_folder, scratch_folder, run_folder)
-
-def _create_job(task, input_, cluster, image, run_parameters, container_description, input_folder, output_folder, scratch_folder, run_folder):
+        name = 'geometry_' + str(i + 1) + '.%s' % input_format
+        files.append((name, data.encode()))
+
+    return files
+
+def _archive(files):
+    """Pack (name, data) pairs in an in-memory tar.gz archive."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+    return buf.getvalue()
+
+def _upload_input(client, input_folder, input_parameters, parameter_indices, geometry_data, input_format, archive=True):
+    files = _input_files(input_parameters, parameter_indices, geometry_data,
+                         input_format)
+    if archive:
+        # A single file is much cheaper to upload to girder and to transfer
+        # to the cluster than thousands of small ones, the job unpacks it
+        files = [(INPUT_ARCHIVE, _archive(files))]
+
+    def upload(file):
+        name, data = file
+        client.uploadFile(input_folder['_id'], io.BytesIO(data), name,
+                          len(data), parentType='folder')
+
+    with ThreadPoolExecutor(STAGING_WORKERS) as executor:
+        list(executor.map(upload, files))
+
+def _create_job(task, cluster, image, run_parameters, container_description, shard, samples=None):
     params = _get_job_parameters(task, cluster, image, run_parameters)
     container = params['container']
     repository = params['repository']
@@ -384,9 +539,10 @@ def _create_job(task, input_, cluster, image, run_parameters, container_descript
     output_dir = os.path.join(guest_dir, job_dir, 'output')
     scratch_dir = os.path.join(guest_dir, job_dir, 'scratch')
 
-    parameters_filename = os.path.join(input_dir, 'input_parameters.json')
-
-    calculation_ids = parse('calculations').find(input_)[0].value
+    calculation_ids = shard['calculations']
+    output_folder = shard['outputFolder']
+    scratch_folder = shard['scratchFolder']
+    run_folder = shard['runFolder']
 
     geometry_filenames = []
     output_filenames = []
@@ -422,6 +578,9 @@ def _create_job(task, input_, cluster, image, run_parameters, container_descript
         'mkdir scratch'
     ]
 
+    if run_parameters.get('archiveInput', True):
+        commands.append('tar -xzf input/%s -C input' % INPUT_ARCHIVE)
+
     # Each contain has a different bind arg
     bind_args = {
         'docker': '-v',
@@ -431,28 +590,44 @@ def _create_job(task, input_, cluster, image, run_parameters, container_descript
 
     mount_option = '%s %s:%s' % (bind_args[container], host_dir, guest_dir)
 
-    container_args = '-p %s -s %s' % (
-        parameters_filename, scratch_dir
-    )
-
-    for g, o in zip(geometry_filenames, output_filenames):
-        container_args += ' -g %s -o %s' % (g, o)
-
     image_str = image.get('repository') + ':' + image.get('tag')
 
     if container == 'singularity':
         # Include the path to the singularity dir, and the extension
         image_str = digest_to_sif(digest)
 
-    if container != 'shifter':
-        commands.append('%s run %s %s %s' % (
-            container, mount_option, image_str, container_args
-        ))
-    # Shifters syntax is pretty different so special case it
-    else:
-        commands.append('shifter %s --image=%s --entrypoint -- %s'  % (
-            mount_option, image_str, container_args
-        ))
+    # The calculations sharing the same input parameters are contiguous, run
+    # the container once for each set of parameters
+    parameter_indices = shard.get('parameters', [0] * len(calculation_ids))
+    groups = [(k, [i for i, _ in members]) for k, members in
+              itertools.groupby(enumerate(parameter_indices),
+                                key=lambda x: x[1])]
+
+    for k, members in groups:
+        parameters_filename = os.path.join(input_dir, _parameters_filename(k))
+        group_scratch_dir = scratch_dir
+        if len(groups) > 1:
+            # Keep the raw files of each invocation apart
+            group_scratch_dir = os.path.join(scratch_dir, str(k + 1))
+            commands.append('mkdir scratch/%s' % (k + 1))
+
+        container_args = '-p %s -s %s' % (
+            parameters_filename, group_scratch_dir
+        )
+
+        for i in members:
+            container_args += ' -g %s -o %s' % (geometry_filenames[i],
+                                                output_filenames[i])
+
+        if container != 'shifter':
+            commands.append('%s run %s %s %s' % (
+                container, mount_option, image_str, container_args
+            ))
+        # Shifters syntax is pretty different so special case it
+        else:
+            commands.append('shifter %s --image=%s --entrypoint -- %s'  % (
+                mount_option, image_str, container_args
+            ))
 
     if is_nersc(cluster):
         # NERSC specific options
@@ -463,13 +638,23 @@ def _create_job(task, input_, cluster, image, run_parameters, container_descript
             'account': os.environ.get('OC_ACCOUNT')
         })
 
+    # Size the job based on the runtime of the previous jobs of this image,
+    # unless explicitly set in the run parameters
+    resources = estimate_resources(cluster, samples or [],
+                                   shard.get('atoms', []),
+                                   shard.get('parameterInfo', {}),
+                                   run_parameters)
+    if resources:
+        task.taskflow.logger.info('Job resources: %s' % resources)
+    job_parameters.update(resources)
+
     body = {
         # ensure there are no special characters in the submission script name
         'name': 'run_%s' % re.sub('[^a-zA-Z0-9]', '_', repository),
         'commands': commands,
         'input': [
             {
-              'folderId': input_folder['_id'],
+              'folderId': shard['inputFolder']['_id'],
               'path': './input'
             }
         ],
@@ -482,35 +667,56 @@ def _create_job(task, input_, cluster, image, run_parameters, container_descript
                 task.taskflow.girder_api_url, task.taskflow.girder_token)
 
     job = client.post('jobs', data=json.dumps(body))
-    task.taskflow.set_metadata('jobs', [job])
 
     return job
 
 @cumulus.taskflow.task
-def submit_calculation(task, input_, cluster, image, run_parameters, root_folder, container_description, input_folder, output_folder, scratch_folder, run_folder):
-    job = _create_job(task, input_, cluster, image, run_parameters, container_description, input_folder, output_folder, scratch_folder, run_folder)
+@timed_stage('submit_calculation')
+def submit_calculation(task, input_, cluster, image, run_parameters, root_folder, container_description, shards):
+    client = create_girder_client(
+        task.taskflow.girder_api_url, task.taskflow.girder_token)
+    samples = load_samples(client, image)
+
+    jobs = [_create_job(task, cluster, image, run_parameters, container_description, shard, samples)
+            for shard in shards]
+    task.taskflow.set_metadata('jobs', jobs)
 
     girder_token = task.taskflow.girder_token
     task.taskflow.set_metadata('cluster', cluster)
 
-    # Now download and submit job to the cluster
-    task.taskflow.logger.info('Uploading the input files to the cluster.')
-    download_job_input_folders(cluster, job,
-                               girder_token=girder_token, submit=False)
+    policy = get_monitor_policy(cluster, run_parameters)
+    links = []
+
+    for shard, job in zip(shards, jobs):
+        # Now download and submit job to the cluster
+        task.taskflow.logger.info('Uploading the input files to the cluster.')
+        with stage_timer(task, 'transfer_input',
+                         'transfer_input_%s' % job['_id']):
+            download_job_input_folders(cluster, job,
+                                       girder_token=girder_token, submit=False)
+
+        task.taskflow.logger.info('Submitting job %s to the queue.' % job['_id'])
 
-    task.taskflow.logger.info('Submitting job %s to the queue.' % job['_id'])
+        submit_job(cluster, job, girder_token=girder_token, monitor=False)
 
-    submit_job(cluster, job, girder_token=girder_token, monitor=False)
+        task.taskflow.logger.info('Submitted job %s to cluster.' % job['_id'])
 
-    task.taskflow.logger.info('Submitted job %s to cluster.' % job['_id'])
+        links.append(postprocess_job.s(input_, cluster, image, run_parameters, root_folder, container_description, shard, job, len(shards)))
 
-    monitor_job.apply_async((cluster, job), {'girder_token': girder_token,
-                                             'monitor_interval': 10},
-                                             countdown=countdown(cluster),
-                            link=postprocess_job.s(input_, cluster, image, run_parameters, root_folder, container_description, input_folder, output_folder, scratch_folder, run_folder, job))
+    # The jobs are polled together, each one is ingested as soon as it
+    # finishes
+    monitor_jobs_adaptively(cluster, jobs, policy, links,
+                            countdown=countdown(cluster))
 
 @cumulus.taskflow.task
-def postprocess_job(task, _, input_, cluster, image, run_parameters, root_folder, container_description, input_folder, output_folder, scratch_folder, run_folder, job):
+def postprocess_job(task, _, input_, cluster, image, run_parameters, root_folder, container_description, shard, job, shard_count=1):
+    start_time = time.time()
+    input_folder = shard['inputFolder']
+    output_folder = shard['outputFolder']
+    scratch_folder = shard['scratchFolder']
+    run_folder = shard['runFolder']
+    calculation_ids = shard['calculations']
+
     task.taskflow.logger.info('Processing the results of the calculation.')
     client = create_girder_client(
         task.taskflow.girder_api_url, task.taskflow.girder_token)
@@ -518,7 +724,8 @@ def postprocess_job(task, _, input_, cluster, image, run_parameters, root_folder
     # Refresh state of job
     job = client.get('jobs/%s' % job['_id'])
 
-    upload_job_output_to_folder(cluster, job, girder_token=task.taskflow.girder_token)
+    with stage_timer(task, 'upload_output', 'upload_output_%s' % job['_id']):
+        upload_job_output_to_folder(cluster, job, girder_token=task.taskflow.girder_token)
 
     # remove temporary input folder, this data is attached to the calculation model
     client.delete('folder/%s' % input_folder['_id'])
@@ -533,44 +740,31 @@ def postprocess_job(task, _, input_, cluster, image, run_parameters, root_folder
 
     # ingest the output of the calculation
     output_format = container_description['output']['format']
-    output_files = []
-    output_items = list(client.listItem(output_folder['_id']))
-    for i in range(len(input_['calculations'])):
-        output_file = None
-        for item in output_items:
-            if item['name'] == 'output_' + str(i + 1) + '.%s' % output_format:
-                files = list(client.listFile(item['_id']))
-                if len(files) != 1:
-                    log_std_err(task, client, run_folder)
-                    log_and_raise(task, 'Expecting a single file under item, found: %s' % len(files))
-                output_file = files[0]
-                break
-
-        if output_file is None:
-            # Log the job stderr
-            log_std_err(task, client, run_folder)
-            log_and_raise(task, 'The calculation did not produce any output file.')
-
-        output_files.append(output_file)
-
-    # remove the run folder, only useful to access the stdout and stderr after the job is done
-    client.delete('folder/%s' % run_folder['_id'])
 
-    # Now call endpoint to ingest result
-    params = {
-        'detectBonds': True
+    # Index the output items by name once
+    output_items = {
+        item['name']: item for item in client.listItem(output_folder['_id'])
     }
 
-    task.taskflow.logger.info('Uploading the results of the calculation to the database.')
-
     code = task.taskflow.get_metadata('code')
     if isinstance(code, dict):
         # Get the contents of "code" to set it below
         code = code.get('code')
 
-    for i, output_file in enumerate(output_files):
+    task.taskflow.logger.info('Uploading the results of the calculation to the database.')
+
+    def ingest(i):
+        calculation_id = calculation_ids[i]
+        item = output_items.get('output_' + str(i + 1) + '.%s' % output_format)
+        if item is None:
+            return 'The calculation did not produce any output file.'
+
+        files = list(client.listFile(item['_id']))
+        if len(files) != 1:
+            return 'Expecting a single file under item, found: %s' % len(files)
+
         body = {
-            'fileId': output_file['_id'],
+            'fileId': files[0]['_id'],
             'format': output_format,
             'public': True,
             'image': image, # image now also has a digest field, add it to the calculation
@@ -578,10 +772,94 @@ def postprocess_job(task, _, input_, cluster, image, run_parameters, root_folder
             'code': code
         }
 
-        client.put('calculations/%s' % input_['calculations'][i], parameters=params, json=body)
+        # Now call endpoint to ingest result
+        params = {
+            'detectBonds': True
+        }
+
+        try:
+            client.put('calculations/%s' % calculation_id, parameters=params,
+                       json=body)
+        except HttpError as ex:
+            return 'Failed to ingest the output: %s' % ex.responseText
+
+        return None
+
+    with stage_timer(task, 'ingest', 'ingest_%s' % job['_id']), \
+            ThreadPoolExecutor(INGEST_WORKERS) as executor:
+        errors = list(executor.map(ingest, range(len(calculation_ids))))
+
+    failed = [(calculation_ids[i], error) for i, error in enumerate(errors)
+              if error is not None]
+
+    if failed:
+        # Log the job stderr
+        log_std_err(task, client, run_folder)
+
+    for calculation_id, error in failed:
+        task.taskflow.logger.error('Calculation %s failed: %s' % (
+            calculation_id, error))
+        _mark_calculation_failed(client, calculation_id, error)
+
+    # remove the run folder, only useful to access the stdout and stderr after the job is done
+    client.delete('folder/%s' % run_folder['_id'])
+
+    if failed and len(failed) == len(calculation_ids):
+        log_and_raise(task, 'None of the calculations produced an output.')
 
-    task.taskflow.logger.log(STATUS_LEVEL, 'Done!')
+    if failed:
+        task.taskflow.logger.warning('%s of %s calculations failed.' % (
+            len(failed), len(calculation_ids)))
 
+    _record_resource_sample(task, client, image, shard, job, len(failed))
+
+    record_stage(task, 'postprocess_job', start_time, time.time(),
+                 'postprocess_job_%s' % job['_id'])
+
+    if shard_count > 1:
+        task.taskflow.logger.log(STATUS_LEVEL, 'Done with job %s of %s.' % (
+            shard['index'] + 1, shard_count))
+    else:
+        task.taskflow.logger.log(STATUS_LEVEL, 'Done!')
+
+
+def _record_resource_sample(task, client, image, shard, job, failed_count):
+    """Store how long the job ran, to size the next jobs of this image."""
+    key = 'stage_run_%s' % job['_id']
+    run = (task.taskflow.get_metadata(key) or {}).get(key)
+    if not run:
+        return
+
+    info = shard.get('parameterInfo', {})
+    succeeded = len(shard['calculations']) - failed_count
+    sample = {
+        'parameters': info.get('hash'),
+        'task': info.get('task'),
+        'basis': info.get('basis'),
+        'calculations': succeeded,
+        'work': workload(shard.get('atoms', [])) * succeeded / len(shard['calculations']),
+        'nodes': job.get('params', {}).get('numberOfNodes', 1),
+        'runtime': run['duration']
+    }
+    record_sample(task, client, image, sample)
+
+def _mark_calculation_failed(client, calculation_id, error):
+    """
+    Clear the pending flag of a calculation and record the error, so that it
+    can be resubmitted on its own. The other properties (taskFlowId, ...) are
+    kept, the endpoint replaces all of them.
+    """
+    try:
+        calculation = client.get('calculations/%s' % calculation_id)
+        properties = calculation.get('properties') or {}
+        properties.update({
+            'pending': False,
+            'error': error
+        })
+        client.put('calculations/%s/properties' % calculation_id,
+                   json=properties)
+    except HttpError:
+        pass
 
 def _ensure_image_on_server(task, repository, tag, digest, container='docker'):
     client = create_girder_client(
@@ -600,6 +878,8 @@ def _ensure_image_on_server(task, repository, tag, digest, container='docker'):
         msg = 'Image does not have container type: ' + container
         log_and_raise(task, msg)
 
+    return images[0]
+
 
 def _get_digest(task, repository, tag):
     client = create_girder_client(
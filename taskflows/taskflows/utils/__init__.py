@@ -1,10 +1,12 @@
 import json
 import os
 import re
+import tempfile
 
 from girder_client import HttpError
 
 from . import avogadro
+from .timing import MONITOR_POLLS_PREFIX
 
 
 def sif_dir():
@@ -141,3 +143,85 @@ def post_image_to_database(client, container, repository, tag, digest, cluster,
         # Just ignore the error if the image already exists
         if e.status != 409:
             raise
+
+
+def save_image_description(task, client, image, description):
+    """
+    Store the container description (the output of the container run with
+    the -d flag) on the image record. It only depends on the image digest,
+    so it never needs to be obtained again for this image.
+    """
+    try:
+        client.patch('images/%s' % image['_id'],
+                     json={'description': description})
+    except HttpError as ex:
+        # Not fatal, the description will be obtained again next time
+        task.taskflow.logger.warning(
+            'Unable to store the container description on image %s: %s' % (
+                image['_id'], ex))
+
+
+# The default job monitoring policy, all the intervals are in seconds. It can
+# be overridden per cluster with the 'monitor' entry of the cluster config,
+# and per taskflow with the 'monitor' run parameter.
+DEFAULT_MONITOR_POLICY = {
+    # The first interval while the job is queued, multiplied by 'backoff'
+    # after every poll up to 'maxInterval'
+    'queuedInterval': 10,
+    'backoff': 2,
+    'maxInterval': 600,
+    # The first interval while the job is running, when its expected runtime
+    # is unknown
+    'runningInterval': 30,
+    # The expected runtime of the job, the polls get closer as it approaches
+    'expectedRuntime': None,
+    # The interval used near the expected completion of the job, and by
+    # cumulus once the job has left the queue
+    'finalInterval': 10
+}
+
+
+def get_monitor_policy(cluster, run_parameters=None):
+    """
+    Returns the monitoring policy of a job, the defaults updated with the
+    cluster and the run parameters settings.
+    """
+    policy = dict(DEFAULT_MONITOR_POLICY)
+    policy.update(cluster.get('config', {}).get('monitor', {}))
+    if run_parameters is not None:
+        policy.update(run_parameters.get('monitor', {}))
+
+    return policy
+
+
+def monitor_interval(policy, state, attempt, running_for=0):
+    """
+    Returns the number of seconds until the next poll of the scheduler.
+
+    state is 'queued' or 'running', attempt is the number of polls since the
+    job entered that state and running_for the number of seconds since the
+    job started running.
+    """
+    backoff = policy['backoff'] ** attempt
+    if state == 'queued':
+        interval = policy['queuedInterval'] * backoff
+    elif policy.get('expectedRuntime'):
+        # Sleep through about half of the expected remaining time, so that
+        # the polls get closer as the job approaches its expected end
+        remaining = policy['expectedRuntime'] - running_for
+        interval = remaining / 2
+    else:
+        interval = policy['runningInterval'] * backoff
+
+    return max(policy['finalInterval'], min(interval, policy['maxInterval']))
+
+
+def count_monitor_poll(task, chain_id):
+    """
+    Increment the number of scheduler polls issued by a chain of monitoring
+    tasks. Each chain has its own counter, the polls of a chain are
+    sequential so no increment is lost. timing.monitor_polls sums them.
+    """
+    key = MONITOR_POLLS_PREFIX + chain_id
+    polls = task.taskflow.get_metadata(key) or {}
+    task.taskflow.set_metadata(key, polls.get(key, 0) + 1)
@@ -0,0 +1,210 @@
+"""Estimation of the resources needed by a batch of calculations
+
+After every job, a sample of the work it contained and the time it ran is
+stored on the image record. The queue, node count and walltime of a new
+job are chosen from the samples of the same image, preferring the ones
+obtained with the same input parameters, then with the same task and basis.
+"""
+import json
+import math
+
+from girder_client import HttpError
+
+from .timing import percentile
+
+# The number of samples kept per image, the oldest ones are dropped first
+MAX_SAMPLES = 200
+
+# The minimum number of matching samples to trust an estimate
+MIN_SAMPLES = 3
+
+# The cost of a calculation is assumed to grow as atoms ** SCALING
+SCALING = 3
+
+# Used for calculations whose atom count could not be determined
+DEFAULT_ATOM_COUNT = 10
+
+# The percentile of the observed rates used, to avoid underestimating
+RATE_PERCENTILE = 90
+
+# Margin applied to the estimated walltime
+SAFETY_FACTOR = 1.5
+
+# Bounds of the estimated walltime, in seconds
+MIN_WALLTIME = 10 * 60
+MAX_WALLTIME = 48 * 60 * 60
+
+# The queues of the known clusters, in order of preference. A cluster can
+# define its own with the 'queues' entry of its config.
+DEFAULT_QUEUES = {
+    'cori': [
+        {'name': 'debug', 'maxWalltime': 30 * 60, 'maxNodes': 64},
+        {'name': 'regular', 'maxWalltime': 48 * 60 * 60, 'maxNodes': 1932}
+    ]
+}
+
+
+def count_atoms(data, input_format):
+    """Returns the number of atoms in a geometry, or None if unknown."""
+    try:
+        if input_format == 'cjson':
+            return len(json.loads(data)['atoms']['elements']['number'])
+        elif input_format == 'xyz':
+            return int(data.split('\n', 1)[0])
+    except (ValueError, KeyError, TypeError):
+        pass
+
+    return None
+
+
+def workload(atom_counts):
+    """The estimated cost of a batch of calculations, in arbitrary units."""
+    return sum((n or DEFAULT_ATOM_COUNT) ** SCALING for n in atom_counts)
+
+
+def _find_image(client, image):
+    params = {
+        'repository': image.get('repository'),
+        'tag': image.get('tag'),
+        'digest': image.get('digest')
+    }
+    images = client.get('images', parameters=params)['results']
+    if not images:
+        return None
+
+    return images[0]
+
+
+def load_samples(client, image):
+    """Returns the resource samples stored on the image record."""
+    try:
+        record = _find_image(client, image)
+    except HttpError:
+        return []
+
+    if record is None:
+        return []
+
+    return record.get('resourceSamples', [])
+
+
+def record_sample(task, client, image, sample):
+    """
+    Append a resource sample to the image record. Concurrent jobs may
+    overwrite each other's sample, which only makes the estimates slightly
+    less accurate.
+    """
+    try:
+        record = _find_image(client, image)
+        if record is None:
+            return
+
+        samples = record.get('resourceSamples', []) + [sample]
+        client.patch('images/%s' % record['_id'],
+                     json={'resourceSamples': samples[-MAX_SAMPLES:]})
+    except HttpError as ex:
+        # Not fatal, it would only have improved the next estimates
+        task.taskflow.logger.warning(
+            'Unable to record the resources used on image %s:%s: %s' % (
+                image.get('repository'), image.get('tag'), ex))
+
+
+def _matching_samples(samples, parameters):
+    keys = [
+        lambda s: s.get('parameters') == parameters.get('hash'),
+        lambda s: (s.get('task') == parameters.get('task') and
+                   s.get('basis') == parameters.get('basis')),
+        lambda s: True
+    ]
+    for key in keys:
+        matching = [s for s in samples
+                    if key(s) and s.get('work') and s.get('runtime')]
+        if len(matching) >= MIN_SAMPLES:
+            return matching
+
+    return []
+
+
+def cluster_queues(cluster):
+    queues = cluster.get('config', {}).get('queues')
+    if queues is None:
+        queues = DEFAULT_QUEUES.get(cluster.get('name'), [])
+
+    return queues
+
+
+def walltime(seconds):
+    """The walltime job parameter, as expected by cumulus."""
+    seconds = int(math.ceil(seconds / 60)) * 60
+    return {
+        'hours': seconds // 3600,
+        'minutes': (seconds % 3600) // 60,
+        'seconds': 0
+    }
+
+
+def estimate_resources(cluster, samples, atom_counts, parameters,
+                       run_parameters=None):
+    """
+    Choose the queue, the number of nodes and the walltime of a job.
+
+    Parameters
+    ----------
+    cluster : dict
+        The cluster the job runs on.
+    samples : list
+        The resource samples of the image, see load_samples.
+    atom_counts : list
+        The number of atoms of each calculation of the job.
+    parameters : dict
+        The 'hash', 'task' and 'basis' of the input parameters of the job.
+    run_parameters : dict
+        The 'queue', 'numberOfNodes', 'walltime' (in seconds) and
+        'constraint' entries override the estimate.
+
+    Returns
+    -------
+    job_parameters : dict
+        The 'queue', 'numberOfNodes', 'maxWallTime' and 'constraint' to use,
+        only the ones that could be determined are present.
+    """
+    if run_parameters is None:
+        run_parameters = {}
+
+    job_parameters = {}
+    queues = cluster_queues(cluster)
+    matching = _matching_samples(samples, parameters)
+
+    if matching and queues:
+        # Node-seconds per unit of work
+        rate = percentile([s['runtime'] * s.get('nodes', 1) / s['work']
+                           for s in matching], RATE_PERCENTILE)
+        node_seconds = rate * workload(atom_counts) * SAFETY_FACTOR
+
+        max_nodes = run_parameters.get('maxNodes', 1)
+        for queue in queues:
+            nodes = max(1, int(math.ceil(node_seconds / queue['maxWalltime'])))
+            nodes = min(nodes, max_nodes, queue['maxNodes'])
+            seconds = max(node_seconds / nodes, MIN_WALLTIME)
+            if seconds <= queue['maxWalltime']:
+                break
+        # Fall back to the last (largest) queue if none fits
+
+        job_parameters.update({
+            'queue': queue['name'],
+            'numberOfNodes': nodes,
+            'maxWallTime': walltime(min(seconds, MAX_WALLTIME,
+                                        queue['maxWalltime']))
+        })
+
+    # Explicit overrides
+    if 'queue' in run_parameters:
+        job_parameters['queue'] = run_parameters['queue']
+    if 'numberOfNodes' in run_parameters:
+        job_parameters['numberOfNodes'] = run_parameters['numberOfNodes']
+    if 'walltime' in run_parameters:
+        job_parameters['maxWallTime'] = walltime(run_parameters['walltime'])
+    if 'constraint' in run_parameters:
+        job_parameters['constraint'] = run_parameters['constraint']
+
+    return job_parameters
@@ -0,0 +1,166 @@
+"""Per-stage timing of the taskflows
+
+Every stage records its start and end timestamps in the taskflow metadata
+under 'stage_<key>'. The timings of many taskflows can then be aggregated
+per image and per cluster with taskflows/scripts/stage_timings.py, which
+does not need the worker dependencies:
+
+    python taskflows/scripts/stage_timings.py --api-url <girder api url> \
+        --api-key <key> <taskflow id> [<taskflow id> ...]
+
+This module only depends on the standard library, so that the script can
+load it without importing the taskflows package.
+"""
+import contextlib
+import functools
+import time
+
+STAGE_PREFIX = 'stage_'
+
+# The number of scheduler polls of each chain of monitoring tasks is stored
+# under 'monitorPolls_<chain id>'
+MONITOR_POLLS_PREFIX = 'monitorPolls_'
+
+# The entry of the aggregated report holding the polls per taskflow
+MONITOR_POLLS = 'monitorPolls'
+
+
+def record_stage(task, name, start, end, key=None):
+    """
+    Record the start and end timestamps (in seconds since the epoch) of a
+    stage. key makes the metadata key unique when a stage runs several
+    times in a taskflow, for example once per job.
+    """
+    if key is None:
+        key = name
+
+    task.taskflow.set_metadata(STAGE_PREFIX + key, {
+        'stage': name,
+        'start': start,
+        'end': end,
+        'duration': end - start
+    })
+
+
+@contextlib.contextmanager
+def stage_timer(task, name, key=None):
+    """Time the enclosed block as a stage of the taskflow."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_stage(task, name, start, time.time(), key)
+
+
+def timed_stage(name):
+    """Decorator timing a whole taskflow task as a stage."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(task, *args, **kwargs):
+            with stage_timer(task, name):
+                return func(task, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def stage_timings(taskflow):
+    """
+    Returns the durations of the stages recorded in a taskflow document, as
+    a dict of stage name -> total duration in seconds.
+    """
+    durations = {}
+    for key, value in taskflow.get('meta', {}).items():
+        if not key.startswith(STAGE_PREFIX) or not isinstance(value, dict):
+            continue
+        stage = value.get('stage', key[len(STAGE_PREFIX):])
+        durations[stage] = durations.get(stage, 0) + value.get('duration', 0)
+
+    return durations
+
+
+def monitor_polls(taskflow):
+    """The number of scheduler polls issued by a taskflow."""
+    return sum(value for key, value in taskflow.get('meta', {}).items()
+               if key.startswith(MONITOR_POLLS_PREFIX) and
+               isinstance(value, int))
+
+
+def _image_name(taskflow):
+    image = taskflow.get('meta', {}).get('image') or {}
+    if not image:
+        return 'unknown'
+
+    return '%s:%s' % (image.get('repository'), image.get('tag'))
+
+
+def _cluster_name(taskflow):
+    cluster = taskflow.get('meta', {}).get('cluster') or {}
+    return cluster.get('name') or cluster.get('_id') or 'unknown'
+
+
+def percentile(values, q):
+    """The q-th percentile of values, with linear interpolation."""
+    values = sorted(values)
+    if not values:
+        return None
+
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def aggregate_timings(taskflows, percentiles=(50, 90, 99)):
+    """
+    Aggregate the stage timings of several taskflows.
+
+    Returns a dict keyed by (image, cluster), the values are dicts of stage
+    name -> {'count': n, 'p50': ..., 'p90': ..., ...}. The number of
+    scheduler polls per taskflow is summarized the same way under
+    MONITOR_POLLS.
+    """
+    samples = {}
+    for taskflow in taskflows:
+        group = (_image_name(taskflow), _cluster_name(taskflow))
+        stages = samples.setdefault(group, {})
+        for stage, duration in stage_timings(taskflow).items():
+            stages.setdefault(stage, []).append(duration)
+        stages.setdefault(MONITOR_POLLS, []).append(monitor_polls(taskflow))
+
+    report = {}
+    for group, stages in samples.items():
+        report[group] = {}
+        for stage, values in stages.items():
+            summary = {'count': len(values)}
+            for q in percentiles:
+                summary['p%s' % q] = percentile(values, q)
+            report[group][stage] = summary
+
+    return report
+
+
+def format_report(report, percentiles=(50, 90, 99)):
+    lines = []
+    for (image, cluster), stages in sorted(report.items()):
+        lines.append('%s on %s' % (image, cluster))
+        header = '  %-24s %6s' % ('stage', 'count')
+        header += ''.join(' %10s' % ('p%s (s)' % q) for q in percentiles)
+        lines.append(header)
+        for stage, summary in sorted(stages.items()):
+            if stage == MONITOR_POLLS:
+                continue
+            line = '  %-24s %6d' % (stage, summary['count'])
+            line += ''.join(' %10.1f' % summary['p%s' % q]
+                            for q in percentiles)
+            lines.append(line)
+
+        polls = stages.get(MONITOR_POLLS)
+        if polls is not None:
+            lines.append('  scheduler polls per taskflow: ' + ', '.join(
+                'p%s %.0f' % (q, polls['p%s' % q]) for q in percentiles))
+
+    return '\n'.join(lines)
+